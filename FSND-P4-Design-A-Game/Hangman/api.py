@@ -6,18 +6,19 @@ primarily with communication to/from the API's users."""
 
 
 import logging
+from datetime import date, datetime, timedelta
 import endpoints
 from protorpc import remote, messages
 from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.api.datastore_errors import TransactionFailedError
+from google.appengine.ext import ndb
 
-from user import (
-    User,
-    UserRank,
-    UserRanks,
-    StringMessage
-)
-from models import Game, Score
+from models import User, Game, Score, UserStats, ArchivedGame
+import counters
+import rollups
+from dictionary import DIFFICULTIES
+from solver import get_solver
+from engine import IllegalMove, HIT, WIN, LOSE
 
 # GameForms, UserRank, UserRanks added
 # To make your import statements more readable you could consider using a more verbose syntax:
@@ -29,28 +30,132 @@ from models import Game, Score
 # This makes development easier, since it's easy to find, add or delete a function.
 from models import (
     NewGameForm,
+    NewGamesForm,
     GameForm,
     MakeMoveForm,
+    MakeMovesForm,
+    MoveResultForm,
+    MoveResultForms,
     ScoreForms,
-    GameForms
+    GameForms,
+    GameSummaryForms,
+    SUMMARY_FIELDS,
+    UserRanks,
+    HintForm,
+    DailyStatsForm,
+    ScoreStatsForm,
+    StringMessage
     )
 
-from utils import get_by_urlsafe
+from utils import (get_by_urlsafe, fetch_page, get_user_names,
+                   run_in_transaction)
+import metrics
+from metrics import instrumented
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
+NEW_GAMES_REQUEST = endpoints.ResourceContainer(NewGamesForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
         urlsafe_game_key=messages.StringField(1),)
 
 GET_SCORE_REQUEST = endpoints.ResourceContainer(
-    number_of_results=messages.IntegerField(1),)
+    number_of_results=messages.IntegerField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3),)
 
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+    MakeMovesForm,
+    urlsafe_game_key=messages.StringField(1),)
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
+USER_PAGE_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3),)
+GAME_SUMMARY_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    active_only=messages.BooleanField(2),
+    fields=messages.StringField(3, repeated=True),
+    page_size=messages.IntegerField(4),
+    cursor=messages.StringField(5),)
+PAGE_REQUEST = endpoints.ResourceContainer(
+    page_size=messages.IntegerField(1),
+    cursor=messages.StringField(2),)
+STATS_REQUEST = endpoints.ResourceContainer(
+    start_date=messages.StringField(1),
+    end_date=messages.StringField(2),)
+
+# MoveResultForm.outcome of a guess rejected by make_moves
+ILLEGAL = 'illegal'
+# Default and maximum number of days of get_score_stats
+STATS_DEFAULT_DAYS = 7
+STATS_MAX_DAYS = 366
+# Most games new_tournament creates in one call
+MAX_TOURNAMENT_GAMES = 2000
+DUPLICATE_MOVE = 'Move already applied'
+
+
+def _move_message(engine, outcome):
+    """Returns the message for a game engine after a guess with outcome.
+    Unicode, guesses may be any alphabetic character"""
+    if outcome == WIN:
+        return u"you win! target was {}".format(engine.target)
+    if outcome == LOSE:
+        return u"you lose! target was {}".format(engine.target)
+    if outcome == HIT:
+        return u"You got it!. Current state is {}, history is {}".format(
+            engine.state, engine.history)
+    guess = engine.history[-1]
+    if len(guess) == 1:
+        return u"{} is not in the target. Current state is {}, history is {}".format(
+            guess, engine.state, engine.history)
+    return u"Current state is {}, history is {}".format(
+        engine.state, engine.history)
+
+
+def _play(urlsafe_game_key, play, request_id=None):
+    """Runs play(engine) on the engine of a Game and saves the result, in a
+    transaction retried with backoff if other moves on the Game conflict.
+    play returns the outcome of its last legal guess, or None if no guess
+    was made. Nothing is saved if the Game already holds request_id.
+    Returns (game, engine, outcome), engine None for such a repeated
+    request."""
+    game = get_by_urlsafe(urlsafe_game_key, Game)
+    if not game:
+        raise endpoints.NotFoundException('Game not found!')
+    # Cheap answer to client retries, without a transaction
+    if request_id and request_id in game.move_ids:
+        metrics.count_event('move_duplicate')
+        return game, None, None
+
+    def move():
+        game = game_key.get()
+        if game is None:
+            # Archived or deleted since the read above
+            raise endpoints.NotFoundException('Game not found!')
+        if request_id and request_id in game.move_ids:
+            metrics.count_event('move_duplicate')
+            return game, None, None
+        # Making move in ended game should never happen, consider as Error.
+        if game.game_over or game.cancelled:
+            raise endpoints.ForbiddenException(
+                'Illegal action: Game is already over.')
+        engine = game.engine()
+        outcome = play(engine)
+        if outcome is not None:
+            game.apply_move(engine, outcome, request_id)
+        return game, engine, outcome
+
+    game_key = game.key
+    try:
+        # xg: a finished game also writes the player's UserStats
+        return run_in_transaction(move, 'move', xg=True)
+    except TransactionFailedError:
+        raise endpoints.ConflictException(
+            'Too many concurrent moves on this game, please retry')
 
-MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
 
 @endpoints.api(name='hang_man', version='v1')
 class HangManApi(remote.Service):
@@ -60,14 +165,15 @@ class HangManApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User. Requires a unique username"""
+        if not request.user_name:
+            raise endpoints.BadRequestException('user_name is required')
         # same user_name can not be used, user_name is unique
-        if User.query(User.name == request.user_name).get():
+        if not User.create(request.user_name, request.email):
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
@@ -76,30 +182,85 @@ class HangManApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
+    @ndb.toplevel
     def new_game(self, request):
         """Creates new game"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
 
-        game = Game.new_game(user.key)
+        if request.difficulty and request.difficulty not in DIFFICULTIES:
+            raise endpoints.BadRequestException(
+                    'difficulty must be one of {}'.format(', '.join(DIFFICULTIES)))
+        try:
+            game = Game.new_game(user.key, user.name, request.word_length,
+                                 request.difficulty)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
 
         # Use a task queue to update the average attempts remaining.
         # This operation is not needed to complete the creation of a new game
         # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_attempts')
+        counters.schedule_average_refresh()
         return game.to_form(
             'You got the {}, word with length {}, please guess the word!'.format(game.state, str(len(game.state))))
 
+    @endpoints.method(request_message=NEW_GAMES_REQUEST,
+                      response_message=GameForms,
+                      path='games/tournament',
+                      name='new_tournament',
+                      http_method='POST')
+    @instrumented
+    @ndb.toplevel
+    def new_tournament(self, request):
+        """Creates rounds new games for each named player. Users are read
+        with one batched get and the games saved with one put_multi; a
+        single average attempts refresh is scheduled."""
+        names = []
+        for name in request.user_names:
+            if name not in names:
+                names.append(name)
+        if not names:
+            raise endpoints.BadRequestException('user_names is required')
+        if request.rounds < 1:
+            raise endpoints.BadRequestException('rounds must be at least 1')
+        if len(names) * request.rounds > MAX_TOURNAMENT_GAMES:
+            raise endpoints.BadRequestException(
+                'At most {} games can be created at once'.format(
+                    MAX_TOURNAMENT_GAMES))
+        if request.difficulty and request.difficulty not in DIFFICULTIES:
+            raise endpoints.BadRequestException(
+                    'difficulty must be one of {}'.format(', '.join(DIFFICULTIES)))
+
+        users = User.get_by_names(names)
+        missing = [name for name in names if name not in users]
+        if missing:
+            raise endpoints.NotFoundException(
+                'No User named {}'.format(', '.join(missing)))
+        try:
+            games = Game.new_games([users[name] for name in names],
+                                   request.rounds, request.word_length,
+                                   request.difficulty, request.same_target)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+        counters.schedule_average_refresh()
+        return GameForms(items=[
+            game.to_form('You got the {}, word with length {}, please guess '
+                         'the word!'.format(game.state, len(game.state)))
+            for game in games])
+
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = get_by_urlsafe(request.urlsafe_game_key, Game, local_cache=True)
         if game:
             return game.to_form('Time to make a move!')
         else:
@@ -110,155 +271,189 @@ class HangManApi(remote.Service):
                       path='game/move/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
+    @ndb.toplevel
     def make_move(self, request):
-        """Makes a move. Returns a game state with message"""
-
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-
-        # Test if the game is already over.
-        # Making move in ended game should never happen, consider as Error.
-        if game.game_over or game.cancelled:
-            raise endpoints.ForbiddenException('Illegal action: Game is already over.')
-
-        # check if guess is NON alphabetic or is empty, if valid set guess as input
-        if not request.character.isalpha():
-            raise endpoints.ForbiddenException(
-                'Illegal action: User can only input alphabetic character')
-
-        guess = request.character.lower()
-
-        # check if guess is already in previous guesses.
-        if guess in game.game_history:
-            raise endpoints.ForbiddenException(
-                'Illegal action: User can not repeat same guess twice')
-
-        # Check player is guessing entire word or not
-        if len(guess) == len(game.target):
-
-            if guess == game.target:
-                game.game_history.append(guess)
-                game.state = game.target
-                game.end_game(True)
-                return game.to_form("you win! target was {}".format(game.target))
-
-            else:
-                game.attempts_remaining -= 1
-
-                if game.attempts_remaining < 1:
-                    game.game_history.append(guess)
-                    game.end_game(False)
-                    return game.to_form("you lose! target was {}".format(game.target))
-                else:
-                    game.game_history.append(guess)
-                    game.put()
-                    return game.to_form(
-                        "Current state is {}, history is {}".format(
-                            game.state, game.game_history))
-
-        # Check in case of single character input
-        if len(guess) == 1:
-            # in case of good guess
-            if guess in game.target:
-                state_list = list(game.state)
-                target_list = list(game.target)
-                for (i, c) in enumerate(target_list):
-                    if c == guess:
-                        state_list[i] = guess
-                game.state = "".join(state_list)
-
-                if game.state == game.target:
-                    game.game_history.append(guess)
-                    game.end_game(True)
-                    return game.to_form("you win! target was {}".format(game.target))
-                else:
-                    game.game_history.append(guess)
-                    game.put()
-                    return game.to_form(
-                        "You got it!. Current state is {}, history is {}".format(
-                            game.state, game.game_history))
-            # Wrong guess with single character
-            else:
-                game.attempts_remaining -= 1
-                if game.attempts_remaining < 1:
-                    game.game_history.append(guess)
-                    game.end_game(False)
-                    return game.to_form("you lose! target was {}".format(game.target))
-                else:
-                    game.game_history.append(guess)
-                    game.put()
-                    return game.to_form("{} is not in the target. Current state is {}, history is {}".format(
-                        guess, game.state, game.game_history))
-        # not entire word, single character, raise Exception as illeal input
-        if len(guess) != len(game.target):
-            raise endpoints.ForbiddenException(
-                'Illegal action: User can not input the guess with different length with target')
+        """Makes a move. Returns a game state with message. The move is
+        applied in a transaction, retried on contention; a retry of a
+        request_id already applied changes nothing."""
+        def play(engine):
+            # The engine checks the guess is alphabetic, new and of length 1
+            # or the target's, and reveals matching letters.
+            try:
+                return engine.guess(request.character)
+            except IllegalMove as e:
+                raise endpoints.ForbiddenException(
+                    'Illegal action: {}'.format(e))
+
+        game, engine, outcome = _play(request.urlsafe_game_key, play,
+                                      request.request_id)
+        if engine is None:
+            return game.to_form(DUPLICATE_MOVE)
+        return game.to_form(_move_message(engine, outcome))
+
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MoveResultForms,
+                      path='game/moves/{urlsafe_game_key}',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrumented
+    @ndb.toplevel
+    def make_moves(self, request):
+        """Makes several moves in order, in one transaction. Illegal guesses
+        are reported and skipped, guesses after the end of the game are
+        ignored. Returns the outcome of each guess made and the final game
+        state"""
+        results = []
+
+        def play(engine):
+            # Runs again if the transaction is retried
+            del results[:]
+            outcome = None
+            for character in request.characters:
+                try:
+                    outcome = engine.guess(character)
+                    result, message = outcome, _move_message(engine, outcome)
+                except IllegalMove as e:
+                    result, message = ILLEGAL, 'Illegal action: {}'.format(e)
+                results.append(MoveResultForm(
+                    character=character, outcome=result, message=message,
+                    state=engine.state,
+                    attempts_remaining=engine.attempts_remaining))
+                if engine.over:
+                    break
+            return outcome
+
+        game, engine, outcome = _play(request.urlsafe_game_key, play,
+                                      request.request_id)
+        if engine is None:
+            message = DUPLICATE_MOVE
+        else:
+            message = results[-1].message if results else 'No guess made'
+        return MoveResultForms(game=game.to_form(message), items=results)
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @instrumented
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
-
-    @endpoints.method(request_message=USER_REQUEST,
+        """Return all scores, one page at a time"""
+        scores, next_cursor, more = fetch_page(Score.query(), request.page_size,
+                                               request.cursor)
+        names = get_user_names(scores)
+        return ScoreForms(items=[score.to_form(names.get(score.user))
+                                 for score in scores],
+                          next_cursor=next_cursor, more=more)
+
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrumented
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        """Returns all of an individual User's scores, one page at a time"""
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores, next_cursor, more = fetch_page(
+            Score.query(Score.user == user.key), request.page_size,
+            request.cursor)
+        return ScoreForms(items=[score.to_form(user.name) for score in scores],
+                          next_cursor=next_cursor, more=more)
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_attempts',
                       name='get_average_attempts_remaining',
                       http_method='GET')
+    @instrumented
     def get_average_attempts(self, request):
         """Get the cached average moves remaining"""
-        return StringMessage(message=memcache.get(MEMCACHE_MOVES_REMAINING) or '')
-
-    @staticmethod
-    def _cache_average_attempts():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_attempts_remaining = sum([game.attempts_remaining
-                                        for game in games])
-            average = float(total_attempts_remaining)/count
-            memcache.set(MEMCACHE_MOVES_REMAINING,
-                         'The average moves remaining is {:.2f}'.format(average))
+        message = memcache.get(counters.MEMCACHE_MOVES_REMAINING)
+        if message is None:
+            message = counters.cache_average_attempts()
+        return StringMessage(message=message or '')
 
     # Extend API, get_user_games: This returns all of a User's active games.
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='games/user/active/{user_name}',
                       name='get_user_active_games',
                       http_method='GET')
+    @instrumented
     def get_user_active_games(self, request):
-        """This returns all of a User's active games"""
-        user = User.query(User.name == request.user_name).get()
-        games = Game.query(Game.user == user.key, Game.game_over == False,
-                           Game.cancelled == False).fetch()
-        return GameForms(items=[game.to_form("Active games of {}".format(user.name)) for game in games])
+        """This returns all of a User's active games, one page at a time"""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        games, next_cursor, more = fetch_page(
+            Game.query(Game.user == user.key, Game.game_over == False,
+                       Game.cancelled == False),
+            request.page_size, request.cursor)
+        return GameForms(items=[game.to_form("Active games of {}".format(user.name),
+                                             user.name) for game in games],
+                         next_cursor=next_cursor, more=more)
 
     # Extend API, get_user_games: This returns all of a User's all games.
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='games/user/all/{user_name}',
                       name='get_user_all_games',
                       http_method='GET')
+    @instrumented
     def get_user_all_games(self, request):
-        """This returns all of a User's active/finished games"""
-        user = User.query(User.name == request.user_name).get()
-        games = Game.query(Game.user == user.key).fetch()
-        return GameForms(items=[game.to_form("All games of {}".format(user.name)) for game in games])
+        """This returns all of a User's active/finished games, one page at a
+        time"""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        games, next_cursor, more = fetch_page(Game.query(Game.user == user.key),
+                                              request.page_size, request.cursor)
+        return GameForms(items=[game.to_form("All games of {}".format(user.name),
+                                             user.name) for game in games],
+                         next_cursor=next_cursor, more=more)
+
+    @endpoints.method(request_message=GAME_SUMMARY_REQUEST,
+                      response_message=GameSummaryForms,
+                      path='games/user/summary/{user_name}',
+                      name='get_user_game_summaries',
+                      http_method='GET')
+    @instrumented
+    def get_user_game_summaries(self, request):
+        """Returns compact summaries of a User's games, one page at a time,
+        read with a projection query. fields limits the fields returned"""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        fields = request.fields or SUMMARY_FIELDS
+        unknown = set(fields) - set(SUMMARY_FIELDS)
+        if unknown:
+            raise endpoints.BadRequestException(
+                    'Unknown fields: {}'.format(', '.join(sorted(unknown))))
+        if request.active_only:
+            query = Game.query(Game.user == user.key, Game.game_over == False,
+                               Game.cancelled == False)
+            # Filtered on, so they can not be projected
+            projection = [Game.attempts_remaining, Game.state]
+        else:
+            query = Game.query(Game.user == user.key)
+            projection = [Game.attempts_remaining, Game.cancelled,
+                          Game.game_over, Game.state]
+        games, next_cursor, more = fetch_page(query, request.page_size,
+                                              request.cursor,
+                                              projection=projection)
+        # Projected entities are read-only, pass the filtered on values
+        known = (dict(game_over=False, cancelled=False)
+                 if request.active_only else {})
+        return GameSummaryForms(items=[game.to_summary_form(fields, **known)
+                                       for game in games],
+                                next_cursor=next_cursor, more=more)
 
     # Extend API,cancel_game: This endpoint allows users to cancel a game in progress
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -266,14 +461,31 @@ class HangManApi(remote.Service):
                       path='game/cancel/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='PUT')
+    @instrumented
+    @ndb.toplevel
     def cancel_game(self, request):
-        """Cancel game in progress."""
+        """Cancel game in progress. Checked and saved in a transaction, so
+        it can not overwrite a concurrent move."""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
-
         if not game:
             raise endpoints.NotFoundException('Game not found!')
-        elif game.game_over:
-            raise endpoints.NotFoundException('Game already over, can not be cancelled.')
+
+        def cancel():
+            game = game_key.get()
+            if game is None:
+                raise endpoints.NotFoundException('Game not found!')
+            if game.game_over:
+                raise endpoints.NotFoundException('Game already over, can not be cancelled.')
+            elif game.cancelled:
+                raise endpoints.NotFoundException('Game already cancelled.')
+            game.cancel()
+
+        game_key = game.key
+        try:
+            run_in_transaction(cancel, 'cancel')
+        except TransactionFailedError:
+            raise endpoints.ConflictException(
+                'Too many concurrent changes to this game, please retry')
         return StringMessage(message="Current game has been cancelled!")
 
     # Extend API,get_high_scores: This endpoint is to return highscores of games,
@@ -283,34 +495,75 @@ class HangManApi(remote.Service):
                       path='game/highscores',
                       name='get_high_scores',
                       http_method='GET')
+    @instrumented
     def get_high_scores(self, request):
-        """return highscores limited with number_of_results"""
-        if request.number_of_results:
-            scores = Score.query(Score.won == True).order(Score.guesses).fetch(limit = request.number_of_results)
-        else:
-            scores = Score.query(Score.won == True).order(Score.guesses).fetch()
-        return ScoreForms(items=[score.to_form() for score in scores])
-
-    @endpoints.method(response_message=UserRanks,
+        """return highscores limited with number_of_results.
+        number_of_results is kept as an alias of page_size"""
+        query = Score.query(Score.won == True).order(Score.guesses)
+        scores, next_cursor, more = fetch_page(
+            query, request.page_size or request.number_of_results,
+            request.cursor)
+        names = get_user_names(scores)
+        return ScoreForms(items=[score.to_form(names.get(score.user))
+                                 for score in scores],
+                          next_cursor=next_cursor, more=more)
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=UserRanks,
                       path='user/rankings',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrumented
     def get_user_rankings(self, request):
-        """Return UserRank class, sorted by win_number with descending order"""
-        items = []
-        users = User.query().fetch()
-
-        for user in users:
-            win_number = 0
-            scores = Score.query(Game.user == user.key).fetch()
-
-            for score in scores:
-                if score.won == True:
-                    win_number += 1
-
-            items.append(UserRank(user_name=user.name, win_number=win_number))
-        items.sort(key=lambda x: x.win_number, reverse=True)
-        return UserRanks(items=items)
+        """Return UserRank class, sorted by win_number with descending order.
+        Reads one page of the UserStats table maintained by Game.end_game"""
+        query = UserStats.query().order(-UserStats.wins)
+        stats, next_cursor, more = fetch_page(query, request.page_size,
+                                              request.cursor)
+        return UserRanks(items=[s.to_form() for s in stats],
+                         next_cursor=next_cursor, more=more)
+
+    @endpoints.method(request_message=STATS_REQUEST,
+                      response_message=ScoreStatsForm,
+                      path='scores/stats',
+                      name='get_score_stats',
+                      http_method='GET')
+    @instrumented
+    def get_score_stats(self, request):
+        """Return game totals, win rate, average guesses and the guesses
+        histogram of a date range (YYYY-MM-DD, inclusive). Summed from the
+        daily rollups maintained by Game.end_game, no Score is read."""
+        try:
+            end = (datetime.strptime(request.end_date, '%Y-%m-%d').date()
+                   if request.end_date else date.today())
+            start = (datetime.strptime(request.start_date, '%Y-%m-%d').date()
+                     if request.start_date else
+                     end - timedelta(days=STATS_DEFAULT_DAYS - 1))
+        except ValueError:
+            raise endpoints.BadRequestException(
+                'Dates must be formatted YYYY-MM-DD')
+        if start > end:
+            raise endpoints.BadRequestException(
+                'start_date must not be after end_date')
+        if (end - start).days >= STATS_MAX_DAYS:
+            raise endpoints.BadRequestException(
+                'At most {} days can be requested'.format(STATS_MAX_DAYS))
+
+        total, days = rollups.get_totals(start, end)
+        form = ScoreStatsForm(start_date=str(start), end_date=str(end),
+                              games=total.games, wins=total.wins,
+                              histogram=total.histogram,
+                              days=[DailyStatsForm(date=str(day),
+                                                   games=days[day].games,
+                                                   wins=days[day].wins)
+                                    for day in sorted(days)])
+        if total.games:
+            form.win_rate = float(total.wins) / total.games
+            form.average_guesses = float(total.guesses) / total.games
+        if total.wins:
+            form.average_guesses_to_win = (float(total.win_guesses) /
+                                           total.wins)
+        return form
 
     # Extend API, get_game_history:
     # Your API Users may want to be able to see a 'history' of moves for each game.
@@ -319,10 +572,43 @@ class HangManApi(remote.Service):
                       path='game/history/{urlsafe_game_key}',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
     def get_game_history(self, request):
-        """return game history of certain game"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        """return game history of certain game, archived games included"""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game, local_cache=True)
+        if not game:
+            game = ArchivedGame.get_by_urlsafe(request.urlsafe_game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
         # TODO: need to check the way to show only Game history
         return game.to_form("Please check Game history!")
 
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/hint/{urlsafe_game_key}',
+                      name='get_hint',
+                      http_method='GET')
+    @instrumented
+    def get_hint(self, request):
+        """Return the letter found in most dictionary words that still match
+        the game state and wrong guesses"""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game, local_cache=True)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over or game.cancelled:
+            raise endpoints.ForbiddenException('Illegal action: Game is already over.')
+        excluded = [guess for guess in game.game_history
+                    if len(guess) == 1 and guess not in game.state]
+        last_guess = game.game_history[-1] if game.game_history else None
+        if last_guess and len(last_guess) != 1:
+            last_guess = None
+        letter, matches, candidates = get_solver().hint(
+            game.state, excluded, last_guess)
+        if not letter:
+            return HintForm(candidates=candidates,
+                            message='No dictionary word matches this game')
+        return HintForm(letter=letter, matches=matches, candidates=candidates,
+                        message='Try {}, it is in {} of {} possible words'.format(
+                            letter, matches, candidates))
+
 api = endpoints.api_server([HangManApi])
@@ -0,0 +1,32 @@
+"""archive.py - Compaction of finished and cancelled games.
+
+Games not updated for ARCHIVE_AFTER_DAYS are copied to ArchivedGame and
+deleted, so the Game queries of the API scale with active games only.
+get_game_history still finds them. Scores are child entities of their Game
+and are kept."""
+
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+
+from models import Game, ArchivedGame
+
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH_SIZE = 200
+
+
+def archive_batch():
+    """Archives up to ARCHIVE_BATCH_SIZE old finished or cancelled games.
+    Returns the number archived; a full batch means there may be more. Safe
+    to repeat: the archive is written before the Game is deleted and is
+    keyed by the Game's id."""
+    cutoff = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    keys = Game.query(Game.game_over == True, Game.updated < cutoff).fetch(
+        ARCHIVE_BATCH_SIZE, keys_only=True)
+    if len(keys) < ARCHIVE_BATCH_SIZE:
+        keys += Game.query(Game.cancelled == True, Game.updated < cutoff).fetch(
+            ARCHIVE_BATCH_SIZE - len(keys), keys_only=True)
+    games = [game for game in ndb.get_multi(keys) if game]
+    ndb.put_multi([ArchivedGame.from_game(game) for game in games])
+    ndb.delete_multi([game.key for game in games])
+    return len(games)
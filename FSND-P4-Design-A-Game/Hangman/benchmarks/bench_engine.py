@@ -0,0 +1,106 @@
+"""bench_engine.py - Compares HangmanEngine with the per-move string/list
+logic make_move used before it (list conversions, linear history checks).
+
+Run from the Hangman directory:
+    python benchmarks/bench_engine.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from engine import HangmanEngine, IllegalMove
+
+TARGET = 'encyclopedia'
+# A losing game: 6 misses interleaved with hits, ending before a win.
+GUESSES = ['e', 'z', 'a', 'q', 'o', 'x', 'i', 'w', 'c', 'v', 'k']
+ATTEMPTS = 6
+NUMBER = 20000
+
+
+def legacy_game(target, guesses):
+    """The old make_move path, one stored game round trip per guess"""
+    state = '_' * len(target)
+    history = []
+    attempts = ATTEMPTS
+    for guess in guesses:
+        if guess in history:
+            raise ValueError(guess)
+        if len(guess) == len(target):
+            history.append(guess)
+            if guess == target:
+                return
+            attempts -= 1
+            if attempts < 1:
+                return
+            continue
+        if guess in target:
+            state_list = list(state)
+            target_list = list(target)
+            for (i, c) in enumerate(target_list):
+                if c == guess:
+                    state_list[i] = guess
+            state = ''.join(state_list)
+            history.append(guess)
+            if state == target:
+                return
+        else:
+            attempts -= 1
+            history.append(guess)
+            if attempts < 1:
+                return
+
+
+def engine_game(target, guesses, store_guessed=True):
+    """The same game, rebuilding the engine from stored state per guess as
+    make_move does. Without store_guessed the guessed letters are replayed
+    from the history, as for Games saved before Game.guessed."""
+    state = '_' * len(target)
+    history = []
+    attempts = ATTEMPTS
+    guessed = 0 if store_guessed else None
+    for guess in guesses:
+        engine = HangmanEngine(target, state, attempts, history, guessed)
+        try:
+            engine.guess(guess)
+        except IllegalMove:
+            raise ValueError(guess)
+        state, attempts, history = (engine.state, engine.attempts_remaining,
+                                    engine.history)
+        if store_guessed:
+            guessed = engine.guessed
+        if engine.over:
+            return
+
+
+def engine_game_replay(target, guesses):
+    return engine_game(target, guesses, store_guessed=False)
+
+
+def engine_game_shared(target, guesses):
+    """The same game on one engine, as a batch of moves is applied"""
+    engine = HangmanEngine(target, '_' * len(target), ATTEMPTS)
+    for guess in guesses:
+        engine.guess(guess)
+        if engine.over:
+            return
+
+
+def main():
+    for name, func in (('legacy per move', legacy_game),
+                       ('engine per move', engine_game),
+                       ('engine replay', engine_game_replay),
+                       ('engine shared', engine_game_shared)):
+        seconds = min(timeit.repeat(lambda: func(TARGET, GUESSES),
+                                    number=NUMBER, repeat=3))
+        print('{:<16} {:8.2f} us/game {:8.2f} us/guess'.format(
+            name, seconds / NUMBER * 1e6,
+            seconds / NUMBER / len(GUESSES) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""bench_solver.py - Benchmarks HintSolver on a large generated word list
+against naive per-request filtering of the words.
+
+Run from the Hangman directory:
+    python benchmarks/bench_solver.py [number of words]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from dictionary import WordDictionary
+from solver import HintSolver
+
+WORDS = 150000
+GAMES = 200
+# Relative frequency of letters in English text, to get realistic buckets
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+WEIGHTS = [82, 15, 28, 43, 127, 22, 20, 61, 70, 2, 8, 40, 24, 67, 75, 19, 1,
+           60, 63, 91, 28, 10, 24, 2, 20, 1]
+
+
+def generate(path, count):
+    population = ''.join(l * w for l, w in zip(LETTERS, WEIGHTS))
+    words = set()
+    while len(words) < count:
+        length = random.randint(4, 12)
+        words.add(''.join(random.choice(population) for _ in range(length)))
+    with open(path, 'w') as f:
+        f.write('\n'.join(sorted(words)))
+
+
+def naive_hint(words, pattern, excluded):
+    """Filters every word of the length, then counts letters"""
+    revealed = set(pattern) - set('_')
+    counts = {}
+    candidates = 0
+    for word in words:
+        if any(c in excluded for c in word):
+            continue
+        if any(p != '_' and p != c or p == '_' and c in revealed
+               for p, c in zip(pattern, word)):
+            continue
+        candidates += 1
+        for c in set(word) - revealed:
+            counts[c] = counts.get(c, 0) + 1
+    if not counts:
+        return None, 0, candidates
+    letter = max(sorted(counts), key=lambda c: counts[c])
+    return letter, counts[letter], candidates
+
+
+def play(target, hint):
+    """Plays target following hint(pattern, excluded, last_guess) and
+    returns the seconds spent in each hint call"""
+    pattern = '_' * len(target)
+    excluded = ''
+    last = None
+    times = []
+    while '_' in pattern and len(excluded) < 6:
+        start = time.time()
+        letter = hint(pattern, excluded, last)[0]
+        times.append(time.time() - start)
+        if letter is None:
+            break
+        if letter in target:
+            pattern = ''.join(c if c == letter else p
+                              for p, c in zip(pattern, target))
+        else:
+            excluded += letter
+        last = letter
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    print('{:<28} {:>6} hints  p50 {:8.3f} ms  p99 {:8.3f} ms'.format(
+        name, len(times), times[len(times) // 2] * 1000,
+        times[int(len(times) * 0.99)] * 1000))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else WORDS
+    random.seed(0)
+    path = os.path.join(tempfile.mkdtemp(), 'words.txt')
+    generate(path, count)
+
+    start = time.time()
+    dictionary = WordDictionary(path)
+    print('dictionary: {} words loaded in {:.2f} s'.format(
+        len(dictionary), time.time() - start))
+
+    solver = HintSolver(dictionary)
+    start = time.time()
+    solver.build_indexes()
+    print('solver indexes built in {:.2f} s'.format(time.time() - start))
+
+    targets = [dictionary.choice(random.randint(6, 10)) for _ in range(GAMES)]
+    by_length = dict((length, list(dictionary.words(length)))
+                     for length in set(len(t) for t in targets))
+
+    naive = []
+    for target in targets[:GAMES // 10]:
+        naive.extend(play(target, lambda p, e, l: naive_hint(
+            by_length[len(p)], p, e)))
+    report('naive filter', naive)
+
+    def cold(pattern, excluded, last):
+        solver.cache.clear()
+        return solver.hint(pattern, excluded)
+    report('solver, no cache', sum((play(t, cold) for t in targets), []))
+
+    solver.cache.clear()
+    report('solver, incremental', sum((play(t, solver.hint)
+                                       for t in targets), []))
+    report('solver, repeated games', sum((play(t, solver.hint)
+                                          for t in targets), []))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""bench_startup.py - Measures what a new instance pays before serving: the
+import time of each app module and the warmup work (word dictionary and
+hint solver indexes), each in a fresh interpreter.
+
+Run from the Hangman directory:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --sdk ~/google-cloud-sdk/platform/google_appengine
+
+Without --sdk only the modules that do not need the App Engine SDK are
+measured.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+RUNS = 9
+
+# Modules importable without the SDK
+PLAIN_MODULES = ('engine', 'cache', 'dictionary', 'solver')
+# Modules needing the SDK; main and api are the two WSGI entry points
+SDK_MODULES = ('models', 'main', 'api')
+# SDK libraries every app module needs, as a reference
+SDK_REFERENCE = (('ndb', 'from google.appengine.ext import ndb'),
+                 ('webapp2', 'import webapp2'),
+                 ('endpoints', 'import endpoints'))
+
+WARMUP = '''
+from dictionary import get_dictionary
+from solver import get_solver
+get_dictionary()
+get_solver().build_indexes()
+'''
+
+CHILD = '''
+import json, os, sys, time
+sdk, app_dir, code = sys.argv[1:4]
+if sdk:
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    # endpoints.api_server reads the app revision from the version id
+    os.environ.setdefault('CURRENT_VERSION_ID', 'bench.1')
+sys.path.insert(0, app_dir)
+start = time.time()
+exec(code)
+print(json.dumps([time.time() - start, 'endpoints' in sys.modules]))
+'''
+
+
+def measure(code, sdk):
+    """Returns the median seconds of code over RUNS fresh interpreters, and
+    whether it loaded endpoints"""
+    times = []
+    for _ in range(RUNS):
+        output = subprocess.check_output(
+            [sys.executable, '-c', CHILD, sdk or '', APP_DIR, code])
+        seconds, endpoints = json.loads(
+            output.decode('ascii').splitlines()[-1])
+        times.append(seconds)
+    return sorted(times)[len(times) // 2], endpoints
+
+
+def report(name, code, sdk):
+    seconds, endpoints = measure(code, sdk)
+    print('{:<27} {:8.1f} ms{}'.format(
+        name, seconds * 1000, '  (loads endpoints)' if endpoints else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', help='Path of the App Engine SDK')
+    args = parser.parse_args()
+
+    modules = PLAIN_MODULES + (SDK_MODULES if args.sdk else ())
+    for name, code in SDK_REFERENCE if args.sdk else ():
+        report('sdk ' + name, code, args.sdk)
+    for module in modules:
+        report('import ' + module, 'import ' + module, args.sdk)
+    report('warmup', WARMUP, args.sdk)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""load_test.py - Load test of HangManApi against the App Engine testbed.
+
+Simulates players doing create_user -> new_game -> make_move until the game
+ends, interleaved round-robin so datastore state grows the way it does under
+concurrent traffic, plus leaderboard reads (get_high_scores,
+get_user_rankings) between rounds. Every RETRY_EVERY-th move is sent twice
+with the same request_id, as a retrying client would, and the repeat is
+reported as 'make_move retry'. The first player also misses with a
+non-ASCII letter and asks get_hint every round. For each endpoint it
+reports p50/p99 latency and datastore/memcache RPCs per call, at each number
+of players, so scaling problems show up as a growing curve. Calls raising an
+exception are counted as errors per endpoint and fail the run.
+
+With --compare, more RPCs per call than the baseline fail the run: with a
+fixed --seed they are deterministic. Latency depends on the machine and is
+only reported, for endpoints with enough calls to be meaningful.
+
+Needs the App Engine Python SDK (with the endpoints library) on the path:
+    python benchmarks/load_test.py --sdk ~/google-cloud-sdk/platform/google_appengine
+    python benchmarks/load_test.py --sdk ... --write-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --sdk ... --compare benchmarks/baseline.json
+
+Calls run one at a time in a single thread (the testbed stubs are not
+thread-safe), so latencies are service times without queueing.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Letters in order of frequency in English words, used as player guesses
+GUESS_ORDER = 'esiarntolcdupmghbyfvkwzxqj'
+LEADERBOARD_EVERY = 10
+RETRY_EVERY = 5
+# RPCs per call this much above the baseline are a regression
+RPC_REGRESSION_RATIO = 1.1
+# A p50 latency this much above the baseline, over at least
+# LATENCY_MIN_CALLS calls, is reported as slower but does not fail the run
+LATENCY_REPORT_RATIO = 2.0
+LATENCY_MIN_CALLS = 50
+
+
+def setup_path(sdk):
+    if sdk:
+        sys.path.insert(0, sdk)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+    sys.path.insert(0, APP_DIR)
+
+
+class RpcCounter(object):
+    """Counts API calls by service through an apiproxy pre-call hook"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def hook(self, service, call, request, response):
+        self.counts['{}.{}'.format(service, call)] += 1
+
+    def take(self):
+        counts, self.counts = self.counts, collections.Counter()
+        return counts
+
+
+class LoadTest(object):
+
+    def __init__(self):
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # endpoints.api_server reads the app revision from the version id
+        self.testbed.setup_env(current_version_id='testbed.1',
+                               overwrite=True)
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_DIR)
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_mail_stub()
+        self.rpcs = RpcCounter()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'load_test', self.rpcs.hook)
+
+        import api
+        self.api_module = api
+        self.api = api.HangManApi()
+        # endpoint -> list of (seconds, rpc Counter)
+        self.samples = collections.defaultdict(list)
+        # endpoint -> list of the exceptions raised, never timed
+        self.errors = collections.defaultdict(list)
+
+    def close(self):
+        self.testbed.deactivate()
+
+    def call(self, name, container, label=None, **fields):
+        """Calls one endpoint as a fresh request and records its cost under
+        label, the endpoint name by default. A call raising an exception is
+        recorded as an error instead, and the exception returned"""
+        from google.appengine.ext import ndb
+        ndb.get_context().clear_cache()
+        request = container.combined_message_class(**fields)
+        self.rpcs.take()
+        start = time.time()
+        try:
+            response = getattr(self.api, name)(request)
+        except Exception as e:
+            self.rpcs.take()
+            self.errors[label or name].append(e)
+            return e
+        self.samples[label or name].append((time.time() - start,
+                                            self.rpcs.take()))
+        return response
+
+    def run(self, players):
+        a = self.api_module
+        prefix = 'p{}-{}-'.format(players, random.randint(0, 1 << 30))
+        names = [prefix + str(i) for i in range(players)]
+        for name in names:
+            self.call('create_user', a.USER_REQUEST, user_name=name)
+        games = {}
+        for name in names:
+            game = self.call('new_game', a.NEW_GAME_REQUEST, user_name=name)
+            if not isinstance(game, Exception):
+                games[name] = (game.urlsafe_key, iter(GUESS_ORDER))
+        # Accepted by the engine but in no dictionary word
+        hinted = games[names[0]][0]
+        self.call('make_move', a.MAKE_MOVE_REQUEST, label='make_move non-ascii',
+                  urlsafe_game_key=hinted, character=u'\xe9')
+
+        round_number = 0
+        moves = 0
+        while games:
+            round_number += 1
+            if names[0] in games:
+                self.call('get_hint', a.GET_GAME_REQUEST,
+                          urlsafe_game_key=hinted)
+            for name in list(games):
+                key, guesses = games[name]
+                moves += 1
+                fields = dict(urlsafe_game_key=key, character=next(guesses),
+                              request_id='{}-{}'.format(prefix, moves))
+                result = self.call('make_move', a.MAKE_MOVE_REQUEST, **fields)
+                if moves % RETRY_EVERY == 0:
+                    self.call('make_move', a.MAKE_MOVE_REQUEST,
+                              label='make_move retry', **fields)
+                if isinstance(result, Exception) or result.game_over:
+                    del games[name]
+            if round_number % LEADERBOARD_EVERY == 0 or not games:
+                self.call('get_high_scores', a.GET_SCORE_REQUEST,
+                          number_of_results=10)
+                self.call('get_user_rankings', a.PAGE_REQUEST)
+
+    def summary(self):
+        """Returns {endpoint: {'calls', 'errors', 'p50_ms', 'p99_ms',
+        'rpcs'}} and resets the samples. Latency and RPCs cover the
+        successful calls only."""
+        result = {}
+        for name in sorted(set(self.samples) | set(self.errors)):
+            samples = self.samples.get(name, [])
+            times = sorted(seconds for seconds, _ in samples)
+            rpcs = collections.Counter()
+            for _, counts in samples:
+                rpcs.update(counts)
+            result[name] = {
+                'calls': len(samples),
+                'errors': len(self.errors.get(name, [])),
+                'p50_ms': percentile(times, 50) * 1000,
+                'p99_ms': percentile(times, 99) * 1000,
+                'rpcs': dict((call, float(n) / len(samples))
+                             for call, n in rpcs.items()),
+            }
+        self.samples.clear()
+        return result
+
+    def take_errors(self):
+        """Returns {endpoint: [exception]} of the failed calls and resets
+        them"""
+        errors, self.errors = self.errors, collections.defaultdict(list)
+        return errors
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def print_report(results):
+    for players, summary in results:
+        print('\n{} players'.format(players))
+        print('{:<20} {:>6} {:>6} {:>9} {:>9}  rpcs/call'.format(
+            'endpoint', 'calls', 'errors', 'p50 ms', 'p99 ms'))
+        for name, row in sorted(summary.items()):
+            rpcs = ', '.join('{} {:.1f}'.format(call.split('.', 1)[1], n)
+                             for call, n in sorted(row['rpcs'].items()))
+            print('{:<20} {:>6} {:>6} {:>9.2f} {:>9.2f}  {}'.format(
+                name, row['calls'], row.get('errors', 0), row['p50_ms'],
+                row['p99_ms'], rpcs))
+
+
+def compare(results, baseline):
+    """Returns (regressions, slower): descriptions of the endpoints making
+    more RPCs per call than in baseline, and of those with a much higher p50
+    latency over enough calls"""
+    regressions = []
+    slower = []
+    baseline = dict((str(players), summary) for players, summary in baseline)
+    for players, summary in results:
+        for name, row in summary.items():
+            old = baseline.get(str(players), {}).get(name)
+            if not old:
+                continue
+            old_rpcs = sum(old['rpcs'].values())
+            new_rpcs = sum(row['rpcs'].values())
+            if new_rpcs > old_rpcs * RPC_REGRESSION_RATIO:
+                regressions.append('{} @{}: rpcs {:.1f} -> {:.1f}'.format(
+                    name, players, old_rpcs, new_rpcs))
+            if (min(row['calls'], old['calls']) >= LATENCY_MIN_CALLS and
+                    row['p50_ms'] > old['p50_ms'] * LATENCY_REPORT_RATIO):
+                slower.append('{} @{}: p50 {:.2f}ms -> {:.2f}ms'.format(
+                    name, players, old['p50_ms'], row['p50_ms']))
+    return regressions, slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', help='Path of the App Engine SDK')
+    parser.add_argument('--players', default='10,50,100,200',
+                        help='Comma separated numbers of players')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-baseline', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    args = parser.parse_args()
+
+    setup_path(args.sdk)
+    random.seed(args.seed)
+    load_test = LoadTest()
+    results = []
+    errors = []
+    try:
+        # Players accumulate across runs, so later runs also measure the
+        # effect of a bigger datastore.
+        for players in [int(n) for n in args.players.split(',')]:
+            load_test.run(players)
+            results.append((players, load_test.summary()))
+            for name, exceptions in load_test.take_errors().items():
+                errors.append('{} @{}: {} failed calls, first: {!r}'.format(
+                    name, players, len(exceptions), exceptions[0]))
+    finally:
+        load_test.close()
+
+    print_report(results)
+    if errors:
+        # A failing endpoint must not pass as a fast one, nor get into a
+        # baseline
+        for error in errors:
+            print('ERROR', error)
+        sys.exit(1)
+    if args.write_baseline:
+        with open(args.write_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+    if args.compare:
+        with open(args.compare) as f:
+            regressions, slower = compare(results, json.load(f))
+        for description in slower:
+            print('SLOWER', description)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
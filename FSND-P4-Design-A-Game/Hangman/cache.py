@@ -0,0 +1,68 @@
+"""cache.py - In-process LRU cache for hot entities.
+
+It sits in front of ndb's memcache layer for read-only endpoints. Every
+instance has its own copy, so an entry can be stale for up to ttl seconds
+after another instance writes the entity; endpoints that modify an entity
+must not read it from here."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache with a size bound and a per-entry TTL.
+    Args:
+        max_size: Number of entries kept, the least recently used entry is
+            evicted first
+        ttl: Seconds an entry is served after it was set"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value cached for key, or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            # Re-insert as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns a dict of the cache counters and size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries),
+                    'max_size': self.max_size, 'ttl': self.ttl}
+
+
+# Entities read by urlsafe key (see utils.get_by_urlsafe)
+ENTITY_CACHE_SIZE = 1000
+ENTITY_CACHE_TTL = 5
+entity_cache = LRUCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
@@ -0,0 +1,136 @@
+"""counters.py - Sharded counters for running totals that change on almost
+every request, such as the number of active games and their attempts
+remaining. Each update touches one random shard, reads add up the shards."""
+
+import random
+import time
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+# Seconds a summed counter value stays in memcache
+MEMCACHE_TIME = 60
+
+ACTIVE_GAMES = 'active_games'
+ACTIVE_ATTEMPTS_REMAINING = 'active_attempts_remaining'
+
+MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
+# At most one average attempts refresh task runs per interval (seconds),
+# however many games start in it.
+AVERAGE_REFRESH_INTERVAL = 30
+MEMCACHE_REFRESH_PENDING = 'AVERAGE_REFRESH_PENDING'
+MEMCACHE_REFRESH_SUPPRESSED = 'AVERAGE_REFRESH_SUPPRESSED'
+
+
+class CounterShard(ndb.Model):
+    """One shard of a named counter"""
+    count = ndb.IntegerProperty(required=True, default=0)
+
+
+def _shard_key(name, index):
+    return ndb.Key(CounterShard, '{}-{}'.format(name, index))
+
+
+def _memcache_key(name):
+    return 'COUNTER-{}'.format(name)
+
+
+def get_counts(names):
+    """Returns a dict with the value of each named counter. Values missing in
+    memcache are summed from their shards in a single batched get."""
+    counts = memcache.get_multi([_memcache_key(n) for n in names])
+    result = {}
+    missing = []
+    for name in names:
+        if _memcache_key(name) in counts:
+            result[name] = counts[_memcache_key(name)]
+        else:
+            missing.append(name)
+    if missing:
+        keys = [_shard_key(n, i) for n in missing for i in range(NUM_SHARDS)]
+        shards = ndb.get_multi(keys)
+        for n, name in enumerate(missing):
+            group = shards[n * NUM_SHARDS:(n + 1) * NUM_SHARDS]
+            result[name] = sum(shard.count for shard in group if shard)
+            memcache.add(_memcache_key(name), result[name], time=MEMCACHE_TIME)
+    return result
+
+
+# Independent: started from on-commit callbacks, which run while the
+# committed transaction is still the current context
+@ndb.transactional_tasklet(propagation=ndb.TransactionOptions.INDEPENDENT)
+def _increment_shard_async(name, delta):
+    key = _shard_key(name, random.randint(0, NUM_SHARDS - 1))
+    shard = yield key.get_async()
+    if shard is None:
+        shard = CounterShard(key=key)
+    shard.count += delta
+    yield shard.put_async()
+
+
+@ndb.tasklet
+def _increment_async(name, delta):
+    yield _increment_shard_async(name, delta)
+    # memcache keeps a non-negative value, decr stops at zero.
+    if delta > 0:
+        memcache.incr(_memcache_key(name), delta)
+    else:
+        memcache.decr(_memcache_key(name), -delta)
+
+
+@ndb.tasklet
+def increment_async(deltas):
+    """Applies a dict of {counter name: delta}. Each counter is updated in
+    its own shard transaction, all of them run in parallel."""
+    yield [_increment_async(name, delta)
+           for name, delta in deltas.items() if delta]
+
+
+def increment(deltas):
+    """Synchronous version of increment_async"""
+    increment_async(deltas).get_result()
+
+
+def reset(name, value):
+    """Overwrites a counter with value, e.g. after recounting from the
+    datastore. Not safe against concurrent increments."""
+    shards = [CounterShard(key=_shard_key(name, i), count=0)
+              for i in range(NUM_SHARDS)]
+    shards[0].count = value
+    ndb.put_multi(shards)
+    memcache.set(_memcache_key(name), value, time=MEMCACHE_TIME)
+
+
+def cache_average_attempts():
+    """Populates memcache with the average moves remaining of active Games,
+    computed from the counters. Returns the message, or None if there is no
+    active game."""
+    counts = get_counts([ACTIVE_GAMES, ACTIVE_ATTEMPTS_REMAINING])
+    count = counts[ACTIVE_GAMES]
+    if count > 0:
+        average = float(counts[ACTIVE_ATTEMPTS_REMAINING])/count
+        message = 'The average moves remaining is {:.2f}'.format(average)
+        memcache.set(MEMCACHE_MOVES_REMAINING, message, time=MEMCACHE_TIME)
+        return message
+
+
+def schedule_average_refresh():
+    """Enqueues the average attempts refresh, coalescing calls so at most
+    one task runs per AVERAGE_REFRESH_INTERVAL. The task is named after
+    its time bucket and runs at the end of it, so a burst of new games is
+    covered by a single refresh even if memcache is flushed. Suppressed
+    calls are counted in memcache."""
+    if not memcache.add(MEMCACHE_REFRESH_PENDING, 1,
+                        time=AVERAGE_REFRESH_INTERVAL):
+        memcache.incr(MEMCACHE_REFRESH_SUPPRESSED, initial_value=0)
+        return
+    now = time.time()
+    bucket = int(now) // AVERAGE_REFRESH_INTERVAL
+    try:
+        taskqueue.add(url='/tasks/cache_average_attempts',
+                      name='cache-average-attempts-{}'.format(bucket),
+                      countdown=(bucket + 1) * AVERAGE_REFRESH_INTERVAL - now)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        memcache.incr(MEMCACHE_REFRESH_SUPPRESSED, initial_value=0)
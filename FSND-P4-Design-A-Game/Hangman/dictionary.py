@@ -0,0 +1,122 @@
+"""dictionary.py - Word dictionary used to pick the target of new games.
+
+The word file (one word per line) is kept as a single buffer, memory-mapped
+when the runtime allows it. Words are addressed by offset, and indexes by
+length and difficulty hold word numbers only, so a large dictionary costs a
+few bytes per word instead of a Python string per word."""
+
+import os
+import random
+import threading
+from array import array
+
+try:
+    import mmap
+except ImportError:
+    # Not whitelisted in every App Engine runtime, fall back to reading the
+    # file into one string.
+    mmap = None
+
+WORDS_FILE = os.path.join(os.path.dirname(__file__), 'words.txt')
+
+EASY = 'easy'
+MEDIUM = 'medium'
+HARD = 'hard'
+DIFFICULTIES = (EASY, MEDIUM, HARD)
+MAX_WORD_LENGTH = 255
+
+
+def word_difficulty(word):
+    """Rates a word by its number of distinct letters. Fewer distinct
+    letters means fewer letters to hit and more chances to miss."""
+    distinct = len(set(word))
+    if distinct >= 7:
+        return EASY
+    elif distinct >= 5:
+        return MEDIUM
+    return HARD
+
+
+class WordDictionary(object):
+    """Offset-indexed word list with O(1) random selection by length and/or
+    difficulty"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if mmap is not None and os.fstat(f.fileno()).st_size:
+                self._buffer = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+            else:
+                self._buffer = f.read()
+        self._offsets = array('I')
+        self._lengths = array('B')
+        # (length or None, difficulty or None) -> array of word numbers
+        self._index = {}
+        self._build_index()
+
+    def _build_index(self):
+        buf = self._buffer
+        size = len(buf)
+        start = 0
+        while start < size:
+            end = buf.find(b'\n', start)
+            if end == -1:
+                end = size
+            word = buf[start:end].strip().lower()
+            if (word and len(word) <= MAX_WORD_LENGTH and word.isalpha() and
+                    buf[start:start + len(word)].lower() == word):
+                number = len(self._offsets)
+                self._offsets.append(start)
+                self._lengths.append(len(word))
+                difficulty = word_difficulty(word)
+                for key in ((None, None), (len(word), None),
+                            (None, difficulty), (len(word), difficulty)):
+                    self._index.setdefault(key, array('I')).append(number)
+            start = end + 1
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def word(self, number):
+        """Returns the word with the given number"""
+        start = self._offsets[number]
+        word = self._buffer[start:start + self._lengths[number]].lower()
+        if not isinstance(word, str):
+            word = word.decode('ascii')
+        return word
+
+    def count(self, length=None, difficulty=None):
+        """Returns the number of words matching length and difficulty"""
+        return len(self._index.get((length, difficulty), ()))
+
+    def numbers(self, length=None, difficulty=None):
+        """Returns the numbers of the words matching length and difficulty"""
+        return self._index.get((length, difficulty), ())
+
+    def choice(self, length=None, difficulty=None):
+        """Returns a random word matching length and difficulty (None
+        matches any), or None if no word matches"""
+        numbers = self._index.get((length, difficulty))
+        if not numbers:
+            return None
+        return self.word(numbers[random.randrange(len(numbers))])
+
+    def words(self, length=None, difficulty=None):
+        """Yields the words matching length and difficulty"""
+        for number in self.numbers(length, difficulty):
+            yield self.word(number)
+
+
+_dictionary = None
+_lock = threading.Lock()
+
+
+def get_dictionary():
+    """Returns the WordDictionary of WORDS_FILE, loaded on first use and
+    shared by all requests of the instance"""
+    global _dictionary
+    if _dictionary is None:
+        with _lock:
+            if _dictionary is None:
+                _dictionary = WordDictionary(WORDS_FILE)
+    return _dictionary
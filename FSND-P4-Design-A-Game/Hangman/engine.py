@@ -0,0 +1,174 @@
+"""engine.py - Hangman rules, independent of the datastore.
+
+The target is precomputed into one bitmask of positions per letter, and the
+guessed letters are kept in a 26-bit mask, so checking, revealing and
+detecting a win are single integer operations per guess. Game builds an
+engine from its properties and copies the result back (see Game.engine);
+it stores the guessed mask too, so building an engine does not replay the
+history."""
+
+HIT = 'hit'
+MISS = 'miss'
+WIN = 'win'
+LOSE = 'lose'
+
+_A = ord('a')
+
+
+class IllegalMove(Exception):
+    """Raised for a guess the rules do not allow"""
+
+
+def _letter_index(c):
+    index = ord(c) - _A
+    if 0 <= index < 26:
+        return index
+    return None
+
+
+# target -> per-letter position masks, shared by every game of the instance
+_POSITIONS_CACHE_SIZE = 10000
+_positions_cache = {}
+
+
+def _target_positions(target):
+    positions = _positions_cache.get(target)
+    if positions is None:
+        positions = [0] * 26
+        for i, c in enumerate(target):
+            index = _letter_index(c)
+            if index is not None:
+                positions[index] |= 1 << i
+        if len(_positions_cache) >= _POSITIONS_CACHE_SIZE:
+            _positions_cache.clear()
+        _positions_cache[target] = positions
+    return positions
+
+
+# state -> mask of its revealed positions, shared the same way
+_revealed_cache = {}
+
+
+def _state_revealed(state):
+    revealed = _revealed_cache.get(state)
+    if revealed is None:
+        revealed = 0
+        for i, c in enumerate(state):
+            if c != '_':
+                revealed |= 1 << i
+        if len(_revealed_cache) >= _POSITIONS_CACHE_SIZE:
+            _revealed_cache.clear()
+        _revealed_cache[state] = revealed
+    return revealed
+
+
+class HangmanEngine(object):
+    """State of one Hangman game.
+    Args:
+        target: The word to guess, lower case
+        state: The revealed target, '_' for hidden letters
+        attempts_remaining: Attempts left before the game is lost
+        history: Previous guesses, oldest first
+        guessed: Mask of the letters in history, as given by the guessed
+            property, or None to rebuild it from history"""
+    __slots__ = ('target', 'attempts_remaining', 'history', '_positions',
+                 '_complete', '_revealed', '_guessed', '_words')
+
+    def __init__(self, target, state, attempts_remaining, history=(),
+                 guessed=None):
+        self.target = target
+        self.attempts_remaining = attempts_remaining
+        self.history = list(history)
+        self._positions = _target_positions(target)
+        self._complete = (1 << len(target)) - 1
+        self._revealed = _state_revealed(state)
+        # Word guesses and letters outside a-z, collected from history on
+        # first use when guessed is given
+        self._words = None
+        if guessed is None:
+            self._guessed = 0
+            self._words = set()
+            for guess in self.history:
+                self._remember(guess)
+        else:
+            self._guessed = guessed
+
+    def _remember(self, guess):
+        index = _letter_index(guess) if len(guess) == 1 else None
+        if index is not None:
+            self._guessed |= 1 << index
+        elif self._words is not None:
+            self._words.add(guess)
+
+    @property
+    def guessed(self):
+        """Mask of the guessed letters, bit n for the nth letter of a-z"""
+        return self._guessed
+
+    def already_guessed(self, guess):
+        """Returns True if guess was made before"""
+        index = _letter_index(guess) if len(guess) == 1 else None
+        if index is not None:
+            return bool(self._guessed >> index & 1)
+        if self._words is None:
+            self._words = set(
+                g for g in self.history
+                if len(g) != 1 or _letter_index(g) is None)
+        return guess in self._words
+
+    @property
+    def won(self):
+        return self._revealed == self._complete
+
+    @property
+    def over(self):
+        return self.won or self.attempts_remaining < 1
+
+    @property
+    def state(self):
+        """The target with hidden letters replaced by '_'"""
+        revealed = self._revealed
+        if revealed == self._complete:
+            return self.target
+        return ''.join([c if revealed >> i & 1 else '_'
+                        for i, c in enumerate(self.target)])
+
+    def _miss(self):
+        self.attempts_remaining -= 1
+        return LOSE if self.attempts_remaining < 1 else MISS
+
+    def guess(self, character):
+        """Applies one guess, a single letter or a whole word.
+        Returns:
+            HIT, MISS, WIN or LOSE
+        Raises:
+            IllegalMove: if the game is over, the guess is not alphabetic,
+            was made before or has a length other than 1 or the target's."""
+        if self.over:
+            raise IllegalMove('Game is already over.')
+        if not character.isalpha():
+            raise IllegalMove('User can only input alphabetic character')
+        guess = character.lower()
+        if self.already_guessed(guess):
+            raise IllegalMove('User can not repeat same guess twice')
+
+        if len(guess) == len(self.target):
+            self.history.append(guess)
+            self._remember(guess)
+            if guess == self.target:
+                self._revealed = self._complete
+                return WIN
+            return self._miss()
+
+        if len(guess) == 1:
+            self.history.append(guess)
+            self._remember(guess)
+            index = _letter_index(guess)
+            positions = self._positions[index] if index is not None else 0
+            if positions:
+                self._revealed |= positions
+                return WIN if self.won else HIT
+            return self._miss()
+
+        raise IllegalMove(
+            'User can not input the guess with different length with target')
@@ -0,0 +1,153 @@
+"""export.py - Offline export of Scores and finished Games for analytics.
+
+An ExportJob walks its query in batches of EXPORT_BATCH_SIZE, one task per
+batch. Each batch is written as a compressed ExportShard of newline
+delimited JSON or CSV, with user names filled in, and saved in the same
+transaction as the job's new cursor, so an interrupted export resumes after
+the last saved shard. Bulk consumers read the shards, never the API."""
+
+import csv
+import json
+from cStringIO import StringIO
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game, Score, ArchivedGame
+from utils import get_user_names
+
+EXPORT_BATCH_SIZE = 500
+FORMATS = ('json', 'csv')
+
+SCORE_COLUMNS = ('user_name', 'date', 'won', 'guesses')
+GAME_COLUMNS = ('urlsafe_key', 'user_name', 'target', 'won', 'cancelled',
+                'attempts_allowed', 'attempts_remaining', 'game_history')
+
+
+def _score_rows(scores):
+    names = get_user_names(scores)
+    for score in scores:
+        yield (names.get(score.user), str(score.date), score.won,
+               score.guesses)
+
+
+def _game_rows(games):
+    names = get_user_names(games)
+    for game in games:
+        yield (game.key.urlsafe(), names.get(game.user), game.target,
+               game.state == game.target, game.cancelled,
+               game.attempts_allowed, game.attempts_remaining,
+               ' '.join(game.game_history))
+
+
+def _archived_game_rows(games):
+    names = get_user_names(games)
+    for game in games:
+        yield (ndb.Key(Game, game.key.id()).urlsafe(), names.get(game.user),
+               game.target, game.state == game.target, game.cancelled,
+               game.attempts_allowed, game.attempts_remaining,
+               game.history or '')
+
+
+# kind -> (query, columns, row function)
+SOURCES = {
+    'Score': (lambda: Score.query(), SCORE_COLUMNS, _score_rows),
+    'Game': (lambda: Game.query(Game.game_over == True), GAME_COLUMNS,
+             _game_rows),
+    'ArchivedGame': (lambda: ArchivedGame.query(), GAME_COLUMNS,
+                     _archived_game_rows),
+}
+
+
+class ExportJob(ndb.Model):
+    """Progress of one export, parent of its ExportShards"""
+    kind = ndb.StringProperty(required=True, choices=SOURCES.keys())
+    format = ndb.StringProperty(required=True, choices=FORMATS)
+    cursor = ndb.StringProperty(indexed=False)
+    shards = ndb.IntegerProperty(required=True, default=0)
+    rows = ndb.IntegerProperty(required=True, default=0)
+    done = ndb.BooleanProperty(required=True, default=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class ExportShard(ndb.Model):
+    """One batch of exported rows, keyed by its number within the job"""
+    data = ndb.BlobProperty(required=True, compressed=True)
+    rows = ndb.IntegerProperty(required=True)
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _serialize(format, columns, rows, header):
+    out = StringIO()
+    if format == 'csv':
+        writer = csv.writer(out)
+        if header:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_encode(value) for value in row])
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row))))
+            out.write('\n')
+    return out.getvalue()
+
+
+def start(kind, format='json'):
+    """Creates an ExportJob and enqueues its first batch. Returns the job"""
+    job = ExportJob(kind=kind, format=format)
+    job.put()
+    enqueue(job.key)
+    return job
+
+
+def enqueue(job_key):
+    taskqueue.add(url='/tasks/export', params={'job': job_key.urlsafe()})
+
+
+def run_batch(job_key):
+    """Exports the next batch of job_key. Returns True when the job is done.
+    Running it again after a failure repeats only the unsaved batch."""
+    job = job_key.get()
+    if job is None or job.done:
+        return True
+    query, columns, row_function = SOURCES[job.kind]
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = query().fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=cursor)
+    rows = list(row_function(entities))
+    data = _serialize(job.format, columns, rows, header=not job.shards)
+
+    @ndb.transactional
+    def save():
+        current = job_key.get()
+        if current.shards != job.shards:
+            # Another run of this batch already saved it
+            return current.done
+        if rows:
+            ExportShard(parent=job_key, id=current.shards + 1, data=data,
+                        rows=len(rows)).put()
+            current.shards += 1
+            current.rows += len(rows)
+        current.cursor = next_cursor.urlsafe() if next_cursor else None
+        current.done = not (more and next_cursor)
+        current.put()
+        return current.done
+    return save()
+
+
+def iter_data(job_key):
+    """Yields the exported data of job_key shard by shard"""
+    number = 1
+    while True:
+        shard = ExportShard.get_by_id(number, parent=job_key)
+        if shard is None:
+            return
+        yield shard.data
+        number += 1
@@ -2,45 +2,275 @@
 
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
+import json
 import logging
+import time
 
 import webapp2
-from google.appengine.api import mail, app_identity
-from api import HangManApi
+from google.appengine.api import app_identity, memcache, taskqueue
+from google.appengine.ext import ndb
 
-from user import User
-from models import Game
+from models import User, Game, Score, UserStats
+from utils import fetch_page, iter_pages, MAX_PAGE_SIZE
+import archive
+import counters
+import export
+import rollups
+from cache import entity_cache
+import metrics
+from metrics import instrumented
 
+# Number of players mailed by one SendReminderBatch task
+REMINDER_BATCH_SIZE = 50
 
 class SendReminderEmail(webapp2.RequestHandler):
+    @instrumented
     def get(self):
         """Send a reminder email to each User with an email about games.
         email will be sent player who has unfinished games.
-        Called every day using a cron job"""
+        Called every day using a cron job. Finds those players with one
+        distinct projection query over active games and fans the emails out
+        to SendReminderBatch tasks of REMINDER_BATCH_SIZE users each."""
+        query = Game.query(Game.game_over == False, Game.cancelled == False,
+                           projection=[Game.user], distinct=True)
+        user_keys = []
+        for games, _ in iter_pages(query, MAX_PAGE_SIZE):
+            user_keys.extend(game.user.urlsafe() for game in games)
+
+        tasks = [taskqueue.Task(url='/tasks/send_reminder_batch',
+                                params={'user': user_keys[i:i + REMINDER_BATCH_SIZE]})
+                 for i in range(0, len(user_keys), REMINDER_BATCH_SIZE)]
+        queue = taskqueue.Queue()
+        # Queue.add takes at most 100 tasks per call
+        for i in range(0, len(tasks), 100):
+            queue.add(tasks[i:i + 100])
+        logging.info('Reminders for {} users in {} tasks'.format(
+            len(user_keys), len(tasks)))
+
+
+class SendReminderBatch(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Send the reminder email to one batch of players with active games.
+        Users are read with a single batched get."""
+        # Imported on first use, most instances never send mail
+        from google.appengine.api import mail
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None).fetch()
-        games = Game.query().fetch()
-
-        for user in users:
-            games = Game.query(Game.user == user.key, Game.game_over == False).fetch
-            if len(games) > 0:
-                subject = 'This is a reminder!'
-                body = 'Hello {}, try out Hangman!'.format(user.name)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
+        keys = [ndb.Key(urlsafe=key) for key in self.request.get_all('user')]
+        for user in ndb.get_multi(keys):
+            if not user or not user.email:
+                continue
+            subject = 'This is a reminder!'
+            body = 'Hello {}, try out Hangman!'.format(user.name)
+            # This will send test emails, the arguments to send_mail are:
+            # from, to, subject, body
+            mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                           user.email,
+                           subject,
+                           body)
 
 class UpdateAverageMovesRemaining(webapp2.RequestHandler):
+    @instrumented
     def post(self):
         """Update game listing announcement in memcache."""
-        HangManApi._cache_average_attempts()
+        counters.cache_average_attempts()
+        suppressed = memcache.get(counters.MEMCACHE_REFRESH_SUPPRESSED)
+        if suppressed:
+            memcache.decr(counters.MEMCACHE_REFRESH_SUPPRESSED, suppressed)
+        logging.info('Average attempts refreshed, {} refresh requests '
+                     'coalesced'.format(suppressed or 0))
+        self.response.set_status(204)
+
+class RebuildUserStats(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Rebuild the UserStats ranking table and the daily rollups from
+        existing Scores. Only needed once for Scores recorded before
+        UserStats and the rollups existed."""
+        totals = {}
+        # date -> DailyRollup totals, only the totals are kept between pages
+        days = {}
+        for scores, _ in iter_pages(Score.query(), MAX_PAGE_SIZE):
+            rollups.add_scores(days, scores)
+            for score in scores:
+                wins, losses = totals.get(score.user, (0, 0))
+                if score.won:
+                    wins += 1
+                else:
+                    losses += 1
+                totals[score.user] = (wins, losses)
+
+        user_keys = totals.keys()
+        stats = []
+        for key, user in zip(user_keys, ndb.get_multi(user_keys)):
+            if not user:
+                continue
+            wins, losses = totals[key]
+            stats.append(UserStats(id=key.id(), user=key, user_name=user.name,
+                                   wins=wins, losses=losses,
+                                   games_played=wins + losses))
+        ndb.put_multi(stats)
+        rollups.rebuild(days)
+        logging.info('Rebuilt UserStats for {} users, rollups of {} days'
+                     .format(len(stats), len(days)))
+        self.response.set_status(204)
+
+class ReconcileCounters(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Recount the active game counters from the datastore. Needed once
+        for Games created before the counters existed, and to repair drift."""
+        games = attempts = 0
+        query = Game.query(Game.game_over == False, Game.cancelled == False)
+        for page, _ in iter_pages(query, MAX_PAGE_SIZE,
+                                  projection=[Game.attempts_remaining]):
+            games += len(page)
+            attempts += sum(game.attempts_remaining for game in page)
+        counters.reset(counters.ACTIVE_GAMES, games)
+        counters.reset(counters.ACTIVE_ATTEMPTS_REMAINING, attempts)
+        logging.info('Active games: {}, attempts remaining: {}'.format(
+            games, attempts))
+        self.response.set_status(204)
+
+class MigrateUsers(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Re-key Users created before users were keyed by name. Moves one
+        page of Users per task run, re-pointing their Games, Scores and
+        UserStats, then enqueues itself for the next page."""
+        users, cursor, more = fetch_page(User.query(), MAX_PAGE_SIZE,
+                                         self.request.get('cursor') or None)
+        for old in users:
+            if old.key.id() == old.name:
+                continue
+            new = User(id=old.name, name=old.name, email=old.email)
+            changed = [new]
+            for model in (Game, Score):
+                entities = model.query(model.user == old.key).fetch()
+                for entity in entities:
+                    entity.user = new.key
+                changed.extend(entities)
+            stats = UserStats.get_by_id(old.key.id())
+            if stats:
+                changed.append(UserStats(id=old.name, user=new.key,
+                                         user_name=stats.user_name,
+                                         wins=stats.wins, losses=stats.losses,
+                                         games_played=stats.games_played))
+                stats.key.delete()
+            ndb.put_multi(changed)
+            old.key.delete()
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_users', params={'cursor': cursor})
+        self.response.set_status(204)
+
+class StartExport(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Start exporting Scores and finished Games. Called by a cron job,
+        the format parameter (json or csv) defaults to json."""
+        format = self.request.get('format') or 'json'
+        if format not in export.FORMATS:
+            self.abort(400)
+        for kind in sorted(export.SOURCES):
+            job = export.start(kind, format)
+            logging.info('Export {} of {} started'.format(job.key.id(), kind))
+
+
+class RunExportBatch(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Export the next batch of a job and enqueue the one after it. A
+        failed run is retried by the task queue from the saved cursor."""
+        job_key = ndb.Key(urlsafe=self.request.get('job'))
+        if not export.run_batch(job_key):
+            export.enqueue(job_key)
         self.response.set_status(204)
 
 
+class DownloadExport(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Return the exported data of a job, or list the recent jobs as JSON
+        if no job is given."""
+        if not self.request.get('job'):
+            jobs = export.ExportJob.query().order(
+                -export.ExportJob.created).fetch(20)
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps([
+                {'job': job.key.urlsafe(), 'kind': job.kind,
+                 'format': job.format, 'rows': job.rows, 'done': job.done,
+                 'created': str(job.created)} for job in jobs]))
+            return
+        job_key = ndb.Key(urlsafe=self.request.get('job'))
+        job = job_key.get()
+        if not job:
+            self.abort(404)
+        self.response.headers['Content-Type'] = (
+            'text/csv' if job.format == 'csv' else 'application/x-ndjson')
+        for data in export.iter_data(job_key):
+            self.response.write(data)
+
+
+class ArchiveGames(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Archive old finished and cancelled games, one batch per run.
+        Called every day using a cron job, continues in a task while full
+        batches are archived."""
+        count = archive.archive_batch()
+        logging.info('Archived {} games'.format(count))
+        if count >= archive.ARCHIVE_BATCH_SIZE:
+            taskqueue.add(url='/crons/archive_games', method='GET')
+
+    post = get
+
+
+class Warmup(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Load the API module, the word dictionary and the hint solver
+        indexes before the instance gets traffic, so its first requests do
+        not pay for them."""
+        start = time.time()
+        import api  # noqa, defines the endpoints service
+        from dictionary import get_dictionary
+        from solver import get_solver
+        loaded = time.time()
+        dictionary = get_dictionary()
+        get_solver().build_indexes()
+        logging.info('Warmup: modules {:.0f} ms, dictionary of {} words and '
+                     'solver {:.0f} ms'.format((loaded - start) * 1000,
+                                               len(dictionary),
+                                               (time.time() - loaded) * 1000))
+        self.response.set_status(204)
+
+
+class Stats(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Report the rolling per-endpoint metrics and the hit/miss counters
+        of the entity cache of this instance, and memcache stats, as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'metrics': metrics.snapshot(),
+            'entity_cache': entity_cache.stats(),
+            'memcache': memcache.get_stats(),
+            'average_refresh_suppressed':
+                memcache.get(counters.MEMCACHE_REFRESH_SUPPRESSED) or 0,
+        }))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/send_reminder_batch', SendReminderBatch),
     ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining),
+    ('/tasks/rebuild_user_stats', RebuildUserStats),
+    ('/tasks/reconcile_counters', ReconcileCounters),
+    ('/tasks/migrate_users', MigrateUsers),
+    ('/admin/stats', Stats),
+    ('/crons/export', StartExport),
+    ('/tasks/export', RunExportBatch),
+    ('/admin/export', DownloadExport),
+    ('/crons/archive_games', ArchiveGames),
+    ('/_ah/warmup', Warmup),
 ], debug=True)
@@ -0,0 +1,196 @@
+"""metrics.py - Per-endpoint latency and RPC instrumentation.
+
+Wrap an endpoint or handler method with @instrumented. A sampled call
+records its wall time, its datastore gets/puts/queries, memcache hits and
+misses and the number of items in the response. Each record is logged as one
+JSON line and added to in-process rolling histograms, read with snapshot().
+Events such as transaction conflicts are counted on every call with
+count_event(), unsampled.
+
+RPCs are counted by apiproxy hooks, so ndb's batched and async calls are
+counted too. Histograms are per instance."""
+
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+from google.appengine.api import apiproxy_stub_map
+
+# Fraction of calls recorded, set by the METRICS_SAMPLE_RATE env variable
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '0.1'))
+# Latency histogram bucket upper bounds (ms), the last bucket is open
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Histograms cover the current and the previous window of this many seconds
+WINDOW_SECONDS = 300
+
+_DATASTORE_CALLS = {
+    'Get': 'datastore_get',
+    'Put': 'datastore_put',
+    'Delete': 'datastore_delete',
+    'RunQuery': 'datastore_query',
+    'Next': 'datastore_query',
+    'Commit': 'datastore_commit',
+}
+_COUNTERS = ('datastore_get', 'datastore_put', 'datastore_delete',
+             'datastore_query', 'datastore_commit', 'memcache_hit',
+             'memcache_miss', 'items')
+
+_local = threading.local()
+
+
+def _pre_call(service, call, request, response):
+    counts = getattr(_local, 'counts', None)
+    if counts is not None and service == 'datastore_v3':
+        name = _DATASTORE_CALLS.get(call)
+        if name:
+            counts[name] += 1
+
+
+def _post_call(service, call, request, response):
+    counts = getattr(_local, 'counts', None)
+    if counts is not None and service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        counts['memcache_hit'] += hits
+        counts['memcache_miss'] += request.key_size() - hits
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('metrics', _pre_call)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('metrics', _post_call)
+
+
+class _Window(object):
+    """Aggregates of one endpoint in one time window"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.counts = defaultdict(int)
+
+    def add(self, ms, counts, error):
+        self.calls += 1
+        self.errors += int(error)
+        self.total_ms += ms
+        bucket = 0
+        while bucket < len(BUCKETS_MS) and ms > BUCKETS_MS[bucket]:
+            bucket += 1
+        self.buckets[bucket] += 1
+        for name, n in counts.items():
+            self.counts[name] += n
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.total_ms += other.total_ms
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        for name, n in other.counts.items():
+            self.counts[name] += n
+
+
+_lock = threading.Lock()
+_window_start = time.time()
+_current = defaultdict(_Window)
+_previous = defaultdict(_Window)
+_current_events = defaultdict(int)
+_previous_events = defaultdict(int)
+
+
+def _rotate():
+    """Starts a new window if the current one is over. Called with _lock"""
+    global _window_start, _current, _previous, _current_events, \
+        _previous_events
+    now = time.time()
+    if now - _window_start >= WINDOW_SECONDS:
+        expired = now - _window_start >= 2 * WINDOW_SECONDS
+        _previous = defaultdict(_Window) if expired else _current
+        _previous_events = defaultdict(int) if expired else _current_events
+        _current = defaultdict(_Window)
+        _current_events = defaultdict(int)
+        _window_start = now
+
+
+def _record(name, ms, counts, error):
+    with _lock:
+        _rotate()
+        _current[name].add(ms, counts, error)
+
+
+def count_event(name, n=1):
+    """Counts n occurrences of the event name in the rolling window"""
+    with _lock:
+        _rotate()
+        _current_events[name] += n
+
+
+def snapshot():
+    """Returns the rolling stats of each endpoint of this instance as a dict:
+    calls, errors, average ms, latency histogram and average counts per
+    call, over the last one to two windows, and the event counts."""
+    with _lock:
+        events = dict(_previous_events)
+        for name, n in _current_events.items():
+            events[name] = events.get(name, 0) + n
+        names = set(_current) | set(_previous)
+        windows = {}
+        for name in names:
+            window = _Window()
+            for source in (_previous, _current):
+                if name in source:
+                    window.merge(source[name])
+            windows[name] = window
+    result = {}
+    for name, window in windows.items():
+        calls = window.calls or 1
+        result[name] = {
+            'calls': window.calls,
+            'errors': window.errors,
+            'avg_ms': round(window.total_ms / calls, 2),
+            'histogram_ms': dict(
+                zip(['<={}'.format(b) for b in BUCKETS_MS] +
+                    ['>{}'.format(BUCKETS_MS[-1])], window.buckets)),
+            'per_call': dict((c, round(float(window.counts[c]) / calls, 2))
+                             for c in _COUNTERS),
+        }
+    return {'sample_rate': SAMPLE_RATE, 'window_seconds': WINDOW_SECONDS,
+            'endpoints': result, 'events': events}
+
+
+def instrumented(func):
+    """Decorator recording a sample of the calls of an endpoint or webapp2
+    handler method"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if (getattr(_local, 'counts', None) is not None or
+                random.random() >= SAMPLE_RATE):
+            return func(self, *args, **kwargs)
+        endpoint = name
+        if hasattr(self, 'response'):
+            # webapp2 handler, name it after the handler class. Checked
+            # without importing protorpc.remote, which task instances do
+            # not otherwise load
+            endpoint = '{}.{}'.format(type(self).__name__, name)
+        _local.counts = counts = defaultdict(int)
+        error = True
+        start = time.time()
+        try:
+            response = func(self, *args, **kwargs)
+            items = getattr(response, 'items', None)
+            if isinstance(items, list):
+                counts['items'] = len(items)
+            error = False
+            return response
+        finally:
+            _local.counts = None
+            ms = (time.time() - start) * 1000
+            logging.info('metrics %s', json.dumps(dict(
+                counts, endpoint=endpoint, ms=round(ms, 2), error=error)))
+            _record(endpoint, ms, counts, error)
+    return wrapper
@@ -2,26 +2,98 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
-import random
 from datetime import date
 from protorpc import messages
 from google.appengine.ext import ndb
 
-# TODO: will increase wordlist.
-WORDS_LIST = ["student", "teacher", "pineapple", "apple", "flower"]
+import counters
+import rollups
+from cache import entity_cache
+from dictionary import get_dictionary
+from engine import HangmanEngine, WIN, LOSE
+
+# Store the owner's name on Game and Score at write time, so rendering them
+# needs no User lookup. Entities written without it fall back to a lookup.
+DENORMALIZE_USER_NAMES = True
+# Game properties a GameSummaryForm can hold
+SUMMARY_FIELDS = ('state', 'attempts_remaining', 'game_over', 'cancelled')
+# Seconds a Game stays in memcache
+GAME_MEMCACHE_TIMEOUT = 600
+# Look up users created before users were keyed by name with a query when
+# no name-keyed User exists. Can be turned off once /tasks/migrate_users ran.
+LEGACY_USER_LOOKUP = True
+# Seconds a User stays in memcache
+USER_MEMCACHE_TIMEOUT = 3600
+# Number of latest move request ids kept on a Game to detect retries
+MOVE_ID_HISTORY = 20
+
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile, keyed by its unique name.
+
+    Gets by key go through ndb's memcache layer: read-through on get and
+    write-through (invalidated then refreshed) on put, so resolving the user
+    of a request is usually a memcache hit."""
+    _use_memcache = True
+    _memcache_timeout = USER_MEMCACHE_TIMEOUT
+
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
 
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User named name, or None if there is none"""
+        if not name:
+            return None
+        user = cls.get_by_id(name)
+        if user is None and LEGACY_USER_LOOKUP:
+            user = cls.query(cls.name == name).get()
+        return user
+
+    @classmethod
+    def get_by_names(cls, names):
+        """Returns a dict of the Users named in names, by name, read with
+        one batched get. Only Users not keyed by name need a query each."""
+        names = [name for name in set(names) if name]
+        users = dict((name, user) for name, user in
+                     zip(names, ndb.get_multi([ndb.Key(cls, name)
+                                               for name in names]))
+                     if user)
+        if LEGACY_USER_LOOKUP:
+            for name in set(names) - set(users):
+                user = cls.query(cls.name == name).get()
+                if user:
+                    users[name] = user
+        return users
+
+    @classmethod
+    def create(cls, name, email=None):
+        """Creates a User named name, checking in a transaction that the name
+        is free. Returns the new User, or None if the name is taken."""
+        if LEGACY_USER_LOOKUP and cls.query(cls.name == name).get():
+            return None
+
+        @ndb.transactional
+        def insert():
+            if cls.get_by_id(name):
+                return None
+            user = cls(id=name, name=name, email=email)
+            user.put()
+            return user
+        return insert()
+
 
 class Game(ndb.Model):
     """Game object, Hangman
 
     Player ranking is evaluated by number of win.
 
+    Gets by key are served from memcache by ndb, which invalidates the entry
+    on every put. Puts also drop the Game from cache.entity_cache.
     """
+    _use_memcache = True
+    _memcache_timeout = GAME_MEMCACHE_TIMEOUT
+
     target = ndb.StringProperty(required=True)
     state = ndb.StringProperty(required=True)
     user = ndb.KeyProperty(required=True, kind='User')
@@ -30,26 +102,72 @@ class Game(ndb.Model):
     attempts_allowed = ndb.IntegerProperty(required=True, default=6)
     attempts_remaining = ndb.IntegerProperty(required=True, default=6)
     game_history = ndb.StringProperty(repeated=True)
+    # Mask of the letters in game_history (see HangmanEngine.guessed), None
+    # on games saved before it existed
+    guessed = ndb.IntegerProperty(indexed=False)
+    user_name = ndb.StringProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+    move_ids = ndb.StringProperty(repeated=True, indexed=False)
 
     @classmethod
-    def new_game(cls, user):
-        """Creates and returns a new game"""
-        target = random.choice(WORDS_LIST)
-        game = Game(target=target,
-                    state="_"*len(target),
-                    user=user,
-                    game_over=False,
-                    cancelled=False)
+    def new_game(cls, user, user_name=None, word_length=None, difficulty=None):
+        """Creates and returns a new game. The target is picked from the
+        word dictionary, optionally filtered by word_length and difficulty.
+        Raises ValueError if no word matches."""
+        target = get_dictionary().choice(word_length, difficulty)
+        if target is None:
+            raise ValueError('No word matches the requested length/difficulty')
+        game = cls._build(target, user, user_name)
+        game._count_active(1, game.attempts_remaining)
         game.put()
         return game
 
-    def to_form(self, message):
-        """Returns a GameForm representation of the Game"""
+    @classmethod
+    def new_games(cls, users, rounds=1, word_length=None, difficulty=None,
+                  same_target=False):
+        """Creates rounds new games for each User of users, saved with one
+        put_multi and one active counters update. With same_target every
+        player gets the same word in a round. Returns the games, round by
+        round. Raises ValueError if no word matches."""
+        dictionary = get_dictionary()
+        games = []
+        for _ in range(rounds):
+            target = None
+            for user in users:
+                if target is None or not same_target:
+                    target = dictionary.choice(word_length, difficulty)
+                    if target is None:
+                        raise ValueError('No word matches the requested '
+                                         'length/difficulty')
+                games.append(cls._build(target, user.key, user.name))
+        cls._count_active(len(games),
+                          sum(game.attempts_remaining for game in games))
+        ndb.put_multi(games)
+        return games
+
+    @classmethod
+    def _build(cls, target, user, user_name=None):
+        """Returns a new unsaved Game of user key with target"""
+        game = cls(target=target,
+                   state="_"*len(target),
+                   user=user,
+                   game_over=False,
+                   cancelled=False,
+                   guessed=0)
+        if DENORMALIZE_USER_NAMES:
+            game.user_name = user_name
+        return game
+
+    def to_form(self, message, user_name=None):
+        """Returns a GameForm representation of the Game. user_name avoids
+        a User lookup when the Game has no stored name."""
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.target = self.target
+        # Only reveal the target once the game is over
+        if self.game_over or self.cancelled:
+            form.target = self.target
         form.state = self.state
-        form.user_name = self.user.get().name
+        form.user_name = user_name or self.user_name or self.user.get().name
         form.game_over = self.game_over
         form.cancelled  = self.cancelled
         form.attempts_allowed = self.attempts_allowed
@@ -58,15 +176,131 @@ class Game(ndb.Model):
         form.message = message
         return form
 
+    def _post_put_hook(self, future):
+        entity_cache.delete(self.key)
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        entity_cache.delete(key)
+
+    def to_summary_form(self, fields=SUMMARY_FIELDS, **known):
+        """Returns a GameSummaryForm with the given fields of the Game. Works
+        on entities of a projection query on those fields; known gives the
+        values of fields that were filtered on instead of projected."""
+        form = GameSummaryForm(urlsafe_key=self.key.urlsafe())
+        for field in fields:
+            setattr(form, field,
+                    known[field] if field in known else getattr(self, field))
+        return form
+
+    def engine(self):
+        """Returns a HangmanEngine holding the state of this Game"""
+        return HangmanEngine(self.target, self.state, self.attempts_remaining,
+                             self.game_history, self.guessed)
+
+    def apply_move(self, engine, outcome, request_id=None):
+        """Copies the state of engine back after a guess and saves the Game,
+        ending it if outcome is WIN or LOSE. The active attempts counter is
+        kept in step so get_average_attempts needs no scan. request_id is
+        remembered so a retry of the same request can be recognized."""
+        lost = self.attempts_remaining - engine.attempts_remaining
+        self.state = engine.state
+        self.attempts_remaining = engine.attempts_remaining
+        self.game_history = engine.history
+        self.guessed = engine.guessed
+        if request_id:
+            self.move_ids = (self.move_ids + [request_id])[-MOVE_ID_HISTORY:]
+        if lost:
+            self._count_active(attempts=-lost)
+        if outcome in (WIN, LOSE):
+            self.end_game(outcome == WIN)
+        else:
+            self.put()
+
+    @staticmethod
+    def _count_active(games=0, attempts=0):
+        """Starts updating the active game counters, once the current
+        transaction commits if there is one. The update is not waited for,
+        so endpoints calling this are wrapped in ndb.toplevel."""
+        deltas = {counters.ACTIVE_GAMES: games,
+                  counters.ACTIVE_ATTEMPTS_REMAINING: attempts}
+        ndb.get_context().call_on_commit(
+            lambda: counters.increment_async(deltas))
+
     def end_game(self, won=False):
         """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        the player lost.
+        The Game, its Score and the player's UserStats are saved in one
+        batched put. The Score is a child entity of the Game. Callers run
+        this in a cross-group transaction, as make_move does through
+        apply_move; the daily rollups and active game counters are updated
+        once it commits, without waiting."""
         self.game_over = True
-        self.put()
         # Add the game to the score 'board'
-        score = Score(user=self.user, date=date.today(), won=won,
+        score = Score(parent=self.key, user=self.user, date=date.today(),
+                      won=won,
                       guesses=self.attempts_allowed - self.attempts_remaining)
-        score.put()
+        if DENORMALIZE_USER_NAMES:
+            score.user_name = self.user_name
+        # Keep the ranking table current in the same batched write.
+        stats = UserStats.for_user(self.user, self.user_name)
+        stats.record(won)
+        self._count_active(-1, -self.attempts_remaining)
+        ndb.get_context().call_on_commit(
+            lambda: rollups.record_async(score.date, won, score.guesses))
+        ndb.put_multi([self, score, stats])
+
+
+    def cancel(self):
+        """Cancels the game, taking it out of the active game counters once
+        the current transaction commits. Callers re-read the Game and call
+        this in a transaction, as cancel_game does."""
+        self.cancelled = True
+        self._count_active(-1, -self.attempts_remaining)
+        self.put()
+
+
+class ArchivedGame(ndb.Model):
+    """Compact copy of a finished or cancelled Game, kept after the Game is
+    deleted by archive.py. Keyed by the id of the Game key. The move history
+    is packed into one unindexed string."""
+    user = ndb.KeyProperty(required=True, kind='User', indexed=False)
+    user_name = ndb.StringProperty(indexed=False)
+    target = ndb.StringProperty(required=True, indexed=False)
+    state = ndb.StringProperty(required=True, indexed=False)
+    cancelled = ndb.BooleanProperty(required=True, indexed=False)
+    attempts_allowed = ndb.IntegerProperty(required=True, indexed=False)
+    attempts_remaining = ndb.IntegerProperty(required=True, indexed=False)
+    history = ndb.TextProperty()
+    updated = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def from_game(cls, game):
+        return cls(id=game.key.id(), user=game.user, user_name=game.user_name,
+                   target=game.target, state=game.state,
+                   cancelled=game.cancelled,
+                   attempts_allowed=game.attempts_allowed,
+                   attempts_remaining=game.attempts_remaining,
+                   history=' '.join(game.game_history), updated=game.updated)
+
+    @classmethod
+    def get_by_urlsafe(cls, urlsafe):
+        """Returns the archive of the Game with urlsafe key, or None"""
+        key = ndb.Key(urlsafe=urlsafe)
+        if key.kind() != Game._get_kind() or key.parent():
+            return None
+        return cls.get_by_id(key.id())
+
+    def to_form(self, message):
+        """Returns a GameForm of the archived Game"""
+        return GameForm(urlsafe_key=ndb.Key(Game, self.key.id()).urlsafe(),
+                        target=self.target, state=self.state,
+                        user_name=self.user_name or self.user.get().name,
+                        game_over=not self.cancelled, cancelled=self.cancelled,
+                        attempts_allowed=self.attempts_allowed,
+                        attempts_remaining=self.attempts_remaining,
+                        game_history=self.history.split() if self.history else [],
+                        message=message)
 
 
 class Score(ndb.Model):
@@ -75,16 +309,53 @@ class Score(ndb.Model):
     date = ndb.DateProperty(required=True)
     won = ndb.BooleanProperty(required=True)
     guesses = ndb.IntegerProperty(required=True)
+    user_name = ndb.StringProperty()
 
-    def to_form(self):
-        return ScoreForm(user_name=self.user.get().name, won=self.won,
+    def to_form(self, user_name=None):
+        user_name = user_name or self.user_name or self.user.get().name
+        return ScoreForm(user_name=user_name, won=self.won,
                          date=str(self.date), guesses=self.guesses)
 
 
+class UserStats(ndb.Model):
+    """Per-user totals backing get_user_rankings.
+
+    Keyed by the id of the User key and updated by Game.end_game, so ranking
+    reads a pre-sorted index instead of counting Scores.
+    """
+    user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty(required=True)
+    wins = ndb.IntegerProperty(required=True, default=0)
+    losses = ndb.IntegerProperty(required=True, default=0)
+    games_played = ndb.IntegerProperty(required=True, default=0)
+
+    @classmethod
+    def for_user(cls, user, user_name=None):
+        """Returns the stats entity of user key, creating it (unsaved) if
+        it does not exist yet."""
+        stats = cls.get_by_id(user.id())
+        if not stats:
+            stats = cls(id=user.id(), user=user,
+                        user_name=user_name or user.get().name)
+        return stats
+
+    def record(self, won):
+        """Counts one finished game"""
+        self.games_played += 1
+        if won:
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def to_form(self):
+        return UserRank(user_name=self.user_name, win_number=self.wins,
+                        losses=self.losses, games_played=self.games_played)
+
+
 class GameForm(messages.Message):
     """GameForm for outbound game state information"""
     urlsafe_key = messages.StringField(1, required=True)
-    target = messages.StringField(2, required=True)
+    target = messages.StringField(2)
     state = messages.StringField(3, required=True)
     user_name = messages.StringField(4, required=True)
     game_over = messages.BooleanField(5, required=True)
@@ -96,16 +367,63 @@ class GameForm(messages.Message):
 
 # Added for get_user_games
 class GameForms(messages.Message):
-    """Return multiple GameForm"""
+    """Return multiple GameForm, with a cursor for the next page"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    more = messages.BooleanField(3)
+
+class GameSummaryForm(messages.Message):
+    """Compact game state for listings, only requested fields are set"""
+    urlsafe_key = messages.StringField(1, required=True)
+    state = messages.StringField(2)
+    attempts_remaining = messages.IntegerField(3)
+    game_over = messages.BooleanField(4)
+    cancelled = messages.BooleanField(5)
+
+class GameSummaryForms(messages.Message):
+    """Return multiple GameSummaryForm, with a cursor for the next page"""
+    items = messages.MessageField(GameSummaryForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    more = messages.BooleanField(3)
 
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    word_length = messages.IntegerField(2)
+    difficulty = messages.StringField(3)
+
+class NewGamesForm(messages.Message):
+    """Used to create the games of a tournament, rounds games per player"""
+    user_names = messages.StringField(1, repeated=True)
+    rounds = messages.IntegerField(2, default=1)
+    word_length = messages.IntegerField(3)
+    difficulty = messages.StringField(4)
+    same_target = messages.BooleanField(5, default=False)
 
 class MakeMoveForm(messages.Message):
-    """Used to make a move in an existing game"""
+    """Used to make a move in an existing game. A retry with the same
+    request_id is not applied twice."""
     character = messages.StringField(1, required=True)
+    request_id = messages.StringField(2)
+
+class MakeMovesForm(messages.Message):
+    """Used to make several moves in an existing game. A retry with the same
+    request_id is not applied twice."""
+    characters = messages.StringField(1, repeated=True)
+    request_id = messages.StringField(2)
+
+class MoveResultForm(messages.Message):
+    """Outcome of one guess of make_moves"""
+    character = messages.StringField(1, required=True)
+    outcome = messages.StringField(2, required=True)
+    message = messages.StringField(3, required=True)
+    state = messages.StringField(4, required=True)
+    attempts_remaining = messages.IntegerField(5, required=True)
+
+class MoveResultForms(messages.Message):
+    """Return the outcome of each guess and the final game state"""
+    game = messages.MessageField(GameForm, 1, required=True)
+    items = messages.MessageField(MoveResultForm, 2, repeated=True)
 
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
@@ -116,17 +434,49 @@ class ScoreForm(messages.Message):
 
 
 class ScoreForms(messages.Message):
-    """Return multiple ScoreForms"""
+    """Return multiple ScoreForms, with a cursor for the next page"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    more = messages.BooleanField(3)
 
 class UserRank(messages.Message):
     """Return user ranking based on number of win"""
     user_name = messages.StringField(1, required=True)
     win_number = messages.IntegerField(2, required=True)
+    losses = messages.IntegerField(3)
+    games_played = messages.IntegerField(4)
 
 class UserRanks(messages.Message):
-    """Return multiple UserRank"""
+    """Return multiple UserRank, with a cursor for the next page"""
     items = messages.MessageField(UserRank, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    more = messages.BooleanField(3)
+
+class HintForm(messages.Message):
+    """Suggested next letter of a game"""
+    letter = messages.StringField(1)
+    matches = messages.IntegerField(2)
+    candidates = messages.IntegerField(3, required=True)
+    message = messages.StringField(4, required=True)
+
+class DailyStatsForm(messages.Message):
+    """Totals of the games finished on one day"""
+    date = messages.StringField(1, required=True)
+    games = messages.IntegerField(2, required=True)
+    wins = messages.IntegerField(3, required=True)
+
+class ScoreStatsForm(messages.Message):
+    """Score statistics of a date range, from the daily rollups.
+    histogram[n] is the number of games finished with n guesses."""
+    start_date = messages.StringField(1, required=True)
+    end_date = messages.StringField(2, required=True)
+    games = messages.IntegerField(3, required=True)
+    wins = messages.IntegerField(4, required=True)
+    win_rate = messages.FloatField(5)
+    average_guesses = messages.FloatField(6)
+    average_guesses_to_win = messages.FloatField(7)
+    histogram = messages.IntegerField(8, repeated=True)
+    days = messages.MessageField(DailyStatsForm, 9, repeated=True)
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
@@ -0,0 +1,95 @@
+"""rollups.py - Daily totals of finished games for score statistics.
+
+Game.end_game adds each result to one random shard of the day's rollup, so
+statistics over a date range read the rollup entities of those days instead
+of every Score. Like counters.py, shards keep concurrent game endings from
+contending on one entity."""
+
+import random
+
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 10
+
+
+class DailyRollup(ndb.Model):
+    """One shard of the totals of the games finished on date.
+    histogram[n] is the number of games finished with n guesses."""
+    date = ndb.DateProperty(required=True)
+    games = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    wins = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    guesses = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    win_guesses = ndb.IntegerProperty(required=True, default=0,
+                                      indexed=False)
+    histogram = ndb.IntegerProperty(repeated=True, indexed=False)
+
+    def add(self, games=0, wins=0, guesses=0, win_guesses=0, histogram=()):
+        self.games += games
+        self.wins += wins
+        self.guesses += guesses
+        self.win_guesses += win_guesses
+        if len(self.histogram) < len(histogram):
+            self.histogram.extend([0] * (len(histogram) - len(self.histogram)))
+        for n, count in enumerate(histogram):
+            self.histogram[n] += count
+
+
+def _shard_key(day, index):
+    return ndb.Key(DailyRollup, '{}-{}'.format(day.isoformat(), index))
+
+
+# Independent: started from on-commit callbacks, which run while the
+# committed transaction is still the current context
+@ndb.transactional_tasklet(propagation=ndb.TransactionOptions.INDEPENDENT)
+def record_async(day, won, guesses):
+    """Adds one game finished on day with guesses to the rollups"""
+    key = _shard_key(day, random.randint(0, NUM_SHARDS - 1))
+    rollup = yield key.get_async()
+    if rollup is None:
+        rollup = DailyRollup(key=key, date=day)
+    histogram = [0] * (guesses + 1)
+    histogram[guesses] = 1
+    rollup.add(games=1, wins=int(won), guesses=guesses,
+               win_guesses=guesses if won else 0, histogram=histogram)
+    yield rollup.put_async()
+
+
+def get_totals(start, end):
+    """Returns (total, days): the DailyRollup totals from start to end
+    inclusive, and a dict of the totals of each day with games"""
+    query = DailyRollup.query(DailyRollup.date >= start,
+                              DailyRollup.date <= end)
+    total = DailyRollup(date=start)
+    days = {}
+    for rollup in query.iter(batch_size=NUM_SHARDS * 31):
+        day = days.get(rollup.date)
+        if day is None:
+            day = days[rollup.date] = DailyRollup(date=rollup.date)
+        for totals in (day, total):
+            totals.add(rollup.games, rollup.wins, rollup.guesses,
+                       rollup.win_guesses, rollup.histogram)
+    return total, days
+
+
+def add_scores(days, scores):
+    """Adds scores to days, a dict of date -> unsaved DailyRollup totals,
+    e.g. page by page while rebuilding"""
+    for score in scores:
+        day = days.get(score.date)
+        if day is None:
+            day = days[score.date] = DailyRollup(key=_shard_key(score.date, 0),
+                                                 date=score.date)
+        histogram = [0] * (score.guesses + 1)
+        histogram[score.guesses] = 1
+        day.add(1, int(score.won), score.guesses,
+                score.guesses if score.won else 0, histogram)
+
+
+def rebuild(days):
+    """Overwrites the rollups of the days with the totals built by
+    add_scores, e.g. for Scores recorded before rollups existed. The totals
+    must cover every Score of those days. Not safe against concurrent game
+    endings."""
+    ndb.delete_multi([_shard_key(date, i) for date in days
+                      for i in range(1, NUM_SHARDS)])
+    ndb.put_multi(days.values())
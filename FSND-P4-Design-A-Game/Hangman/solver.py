@@ -0,0 +1,165 @@
+"""solver.py - Hint engine suggesting the most informative next letter.
+
+Words of one length are numbered 0..n-1 inside their length bucket and every
+constraint is an n-bit Python int: one bitset per (position, letter) and one
+per letter present anywhere. The candidates for a pattern are an AND of a
+few bitsets, and candidate sets are cached by (length, pattern, excluded
+letters), so a hint after one more guess starts from the previous set and
+applies only the new constraint."""
+
+import binascii
+import threading
+from array import array
+
+from cache import LRUCache
+from dictionary import get_dictionary, MAX_WORD_LENGTH
+
+# Cached candidate sets, each up to n/8 bytes for a bucket of n words
+HINT_CACHE_SIZE = 1000
+HINT_CACHE_TTL = 3600
+
+_A = ord('a')
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_int(bits):
+    """Converts a little-endian bytearray of bits to an int"""
+    return int(binascii.hexlify(bytes(bits[::-1])) or b'0', 16)
+
+
+def _popcount(n):
+    return bin(n).count('1')
+
+
+class _LengthIndex(object):
+    """Bitset indexes of the words of one length"""
+    __slots__ = ('length', 'numbers', 'all', 'position', 'presence')
+
+    def __init__(self, dictionary, length):
+        self.length = length
+        self.numbers = array('I', dictionary.numbers(length))
+        size = (len(self.numbers) + 7) // 8
+        position = [bytearray(size) for _ in range(26 * length)]
+        presence = [bytearray(size) for _ in range(26)]
+        for bit, number in enumerate(self.numbers):
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            for i, c in enumerate(dictionary.word(number)):
+                letter = ord(c) - _A
+                position[i * 26 + letter][byte] |= mask
+                presence[letter][byte] |= mask
+        self.all = (1 << len(self.numbers)) - 1
+        self.position = [_to_int(bits) for bits in position]
+        self.presence = [_to_int(bits) for bits in presence]
+
+    def reveal(self, candidates, pattern, letter):
+        """Narrows candidates to words with letter exactly where pattern
+        shows it"""
+        for i, c in enumerate(pattern):
+            bits = self.position[i * 26 + letter]
+            if c == '_':
+                candidates &= ~bits
+            elif ord(c) - _A == letter:
+                candidates &= bits
+        return candidates
+
+    def exclude(self, candidates, letter):
+        """Narrows candidates to words without letter"""
+        return candidates & ~self.presence[letter]
+
+
+class HintSolver(object):
+    """Suggests letters for games whose target is in dictionary"""
+
+    def __init__(self, dictionary):
+        self._dictionary = dictionary
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.cache = LRUCache(HINT_CACHE_SIZE, HINT_CACHE_TTL)
+
+    def _index(self, length):
+        index = self._indexes.get(length)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(length)
+                if index is None:
+                    index = _LengthIndex(self._dictionary, length)
+                    self._indexes[length] = index
+        return index
+
+    def build_indexes(self):
+        """Builds the index of every word length of the dictionary now
+        instead of on first use"""
+        for length in range(1, MAX_WORD_LENGTH + 1):
+            if self._dictionary.count(length):
+                self._index(length)
+
+    def candidates(self, pattern, excluded, last_guess=None):
+        """Returns the bitset of the words matching pattern ('_' for hidden
+        letters) that contain none of the excluded letters. last_guess, the
+        letter revealed or excluded by the latest guess, lets the result be
+        derived from the cached set of the previous state; a longer guess or
+        one outside a-z is ignored."""
+        index = self._index(len(pattern))
+        # Letters outside a-z, accepted by the engine, are in no word
+        excluded = ''.join(sorted(set(excluded) & set(LETTERS)))
+        key = (len(pattern), pattern, excluded)
+        candidates = self.cache.get(key)
+        if candidates is not None:
+            return candidates
+
+        # A whole word guess, or a letter outside a-z, reveals or excludes
+        # no indexed letter
+        letter_guess = (last_guess is not None and len(last_guess) == 1 and
+                        last_guess in LETTERS)
+        if letter_guess and last_guess in pattern:
+            parent = self.cache.get(
+                (len(pattern), pattern.replace(last_guess, '_'), excluded))
+            if parent is not None:
+                candidates = index.reveal(parent, pattern,
+                                          ord(last_guess) - _A)
+        elif letter_guess and last_guess in excluded:
+            parent = self.cache.get(
+                (len(pattern), pattern, excluded.replace(last_guess, '')))
+            if parent is not None:
+                candidates = index.exclude(parent, ord(last_guess) - _A)
+
+        if candidates is None:
+            candidates = index.all
+            for letter in set(pattern) - set('_'):
+                candidates = index.reveal(candidates, pattern,
+                                          ord(letter) - _A)
+            for letter in excluded:
+                candidates = index.exclude(candidates, ord(letter) - _A)
+        self.cache.set(key, candidates)
+        return candidates
+
+    def hint(self, pattern, excluded, last_guess=None):
+        """Returns (letter, matches, candidates): the unguessed letter found
+        in the most candidate words, the number of those words and the number
+        of candidates. letter is None if no word matches."""
+        index = self._index(len(pattern))
+        candidates = self.candidates(pattern, excluded, last_guess)
+        guessed = set(pattern) | set(excluded)
+        best, best_matches = None, 0
+        for letter in range(26):
+            if chr(_A + letter) in guessed:
+                continue
+            matches = _popcount(candidates & index.presence[letter])
+            if matches > best_matches:
+                best, best_matches = chr(_A + letter), matches
+        return best, best_matches, _popcount(candidates)
+
+
+_solver = None
+_solver_lock = threading.Lock()
+
+
+def get_solver():
+    """Returns the HintSolver of the word dictionary, shared by all requests
+    of the instance. Length indexes are built on first use."""
+    global _solver
+    if _solver is None:
+        with _solver_lock:
+            if _solver is None:
+                _solver = HintSolver(get_dictionary())
+    return _solver
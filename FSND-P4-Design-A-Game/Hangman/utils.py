@@ -1,10 +1,30 @@
 """utils.py - File for collecting general utility functions."""
 
 import logging
+import random
+import time
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
-import endpoints
+from google.appengine.datastore.datastore_query import Cursor
 
-def get_by_urlsafe(urlsafe, model):
+import metrics
+from cache import entity_cache
+
+# Retries of run_in_transaction after a conflict, and the first backoff
+# (seconds), doubled on each retry
+TRANSACTION_RETRIES = 3
+TRANSACTION_BACKOFF = 0.05
+
+
+def bad_request(message):
+    """Returns an endpoints.BadRequestException with message. endpoints is
+    imported on first use, so that task and cron handlers using these
+    helpers do not load it."""
+    import endpoints
+    return endpoints.BadRequestException(message)
+
+
+def get_by_urlsafe(urlsafe, model, local_cache=False):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
         error if the key String is malformed or the entity is of the incorrect
@@ -12,6 +32,9 @@ def get_by_urlsafe(urlsafe, model):
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
+        local_cache: Serve the entity from the in-process cache.entity_cache
+            when possible. Only for read-only callers, the entry may be up
+            to cache.ENTITY_CACHE_TTL seconds stale.
     Returns:
         The entity that the urlsafe Key string points to or None if no entity
         exists.
@@ -20,16 +43,120 @@ def get_by_urlsafe(urlsafe, model):
     try:
         key = ndb.Key(urlsafe=urlsafe)
     except TypeError:
-        raise endpoints.BadRequestException('Invalid Key')
+        raise bad_request('Invalid Key')
     except Exception, e:
         if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-            raise endpoints.BadRequestException('Invalid Key')
+            raise bad_request('Invalid Key')
         else:
             raise
 
-    entity = key.get()
-    if not entity:
-        return None
+    entity = entity_cache.get(key) if local_cache else None
+    if entity is None:
+        entity = key.get()
+        if not entity:
+            return None
+        if local_cache:
+            entity_cache.set(key, entity)
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
     return entity
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def fetch_page(query, page_size=None, urlsafe_cursor=None, **options):
+    """Fetches one page of query results using a datastore cursor.
+    Args:
+        query: The ndb.Query to page through
+        page_size: Requested number of results, at least 1 and bounded by
+            MAX_PAGE_SIZE
+        urlsafe_cursor: Opaque cursor returned with the previous page
+        options: Extra query options passed to fetch_page (e.g. projection)
+    Returns:
+        A tuple (results, next_cursor, more), next_cursor being a urlsafe
+        string or None.
+    Raises:
+        endpoints.BadRequestException: if page_size is less than 1 or the
+            cursor is malformed or does not belong to query."""
+    if page_size is None:
+        page_size = DEFAULT_PAGE_SIZE
+    elif page_size < 1:
+        raise bad_request('Invalid page_size')
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    cursor = None
+    if urlsafe_cursor:
+        try:
+            cursor = Cursor(urlsafe=urlsafe_cursor)
+        except Exception:
+            raise bad_request('Invalid cursor')
+    try:
+        results, next_cursor, more = query.fetch_page(
+            page_size, start_cursor=cursor, **options)
+    except datastore_errors.BadRequestError:
+        # A well-formed cursor of another query
+        raise bad_request('Invalid cursor')
+    next_cursor = next_cursor.urlsafe() if (more and next_cursor) else None
+    return results, next_cursor, more
+
+
+def get_user_names(entities):
+    """Resolves the owner names of entities with a `user` KeyProperty.
+    Names already stored on the entities are used as is, the remaining
+    User keys are fetched in a single batched get. ndb's in-context cache
+    keeps the fetched Users for the rest of the request.
+    Args:
+        entities: Game or Score entities
+    Returns:
+        A dict mapping User keys to user names."""
+    names = {}
+    for entity in entities:
+        if getattr(entity, 'user_name', None):
+            names[entity.user] = entity.user_name
+    missing = list(set(e.user for e in entities) - set(names))
+    for key, user in zip(missing, ndb.get_multi(missing)):
+        if user:
+            names[key] = user.name
+    return names
+
+
+def iter_pages(query, batch_size=None, urlsafe_cursor=None, **options):
+    """Walks a query one page at a time, so large result sets are never
+    held in memory at once.
+    Yields:
+        Tuples (results, next_cursor) where next_cursor resumes the walk
+        after this page, or is None on the last page."""
+    while True:
+        results, urlsafe_cursor, more = fetch_page(
+            query, batch_size, urlsafe_cursor, **options)
+        yield results, urlsafe_cursor
+        if not urlsafe_cursor:
+            return
+
+
+def run_in_transaction(func, name, retries=TRANSACTION_RETRIES, **options):
+    """Runs func in a datastore transaction, retrying it on contention with
+    exponential backoff and jitter. Only the entity groups func touches are
+    locked. Conflicts and retries are counted as the metrics events
+    '<name>_conflict' and '<name>_retry'.
+    Args:
+        func: Function run in the transaction, must be safe to run again
+        name: Prefix of the metrics events
+        retries: Number of retries after the first conflict
+        options: Extra transaction options (e.g. xg=True)
+    Returns:
+        The return value of func
+    Raises:
+        TransactionFailedError: the transaction conflicted on every try"""
+    delay = TRANSACTION_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            return ndb.transaction(func, retries=0, **options)
+        except datastore_errors.TransactionFailedError:
+            metrics.count_event(name + '_conflict')
+            if attempt == retries:
+                raise
+        metrics.count_event(name + '_retry')
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2